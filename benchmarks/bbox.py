@@ -0,0 +1,107 @@
+"""
+Compare ways of finding the chair's bounding box in a white-background render.
+
+"numpy_where" is the method crop_seeing_3d_chairs_data.py used originally: a
+full-image boolean mask, with every coordinate materialised by np.where.
+"projections" reduces the mask to row and column projections first. "pil" is
+content_bbox() from the crop script, which lets PIL find the box on the uint8 data.
+
+Run from the project root directory, on real renders:
+    python benchmarks/bbox.py --images "raw_data/source/seeing_3d_chairs_rendered_chairs/*/renders/*.png"
+or on synthetic 600x600 renders, with no arguments.
+"""
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "preprocessing")
+)
+from crop_seeing_3d_chairs_data import content_bbox  # noqa: E402
+
+
+def bbox_numpy_where(img):
+    img_array = np.array(img)
+    non_white_pixels = np.where(np.any(img_array != [255, 255, 255], axis=-1))
+    return (
+        np.min(non_white_pixels[1]),
+        np.min(non_white_pixels[0]),
+        np.max(non_white_pixels[1]),
+        np.max(non_white_pixels[0]),
+    )
+
+
+def bbox_projections(img):
+    img_array = np.asarray(img)
+    # a pixel is white only if its smallest channel is 255
+    mask = img_array.min(axis=-1) != 255
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    return cols[0], rows[0], cols[-1], rows[-1]
+
+
+METHODS = {
+    "numpy_where": bbox_numpy_where,
+    "projections": bbox_projections,
+    "pil": content_bbox,
+}
+
+
+def synthetic_renders(count=50, size=600, seed=0):
+    """White images with a randomly placed and sized grey-ish block."""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        img_array = np.full((size, size, 3), 255, dtype=np.uint8)
+        top, left = rng.integers(0, size // 2, size=2)
+        bottom, right = rng.integers(size // 2, size, size=2)
+        img_array[top:bottom, left:right] = rng.integers(0, 250, size=3)
+        images.append(Image.fromarray(img_array))
+    return images
+
+
+def benchmark(images, repeats=3):
+    """Return the per-image time of each method, checking they all agree."""
+    results = {}
+    expected = [tuple(int(v) for v in bbox_numpy_where(img)) for img in images]
+    for name, method in METHODS.items():
+        actual = [tuple(int(v) for v in method(img)) for img in images]
+        if actual != expected:
+            raise AssertionError(f"{name} disagrees with the original method")
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            for img in images:
+                method(img)
+            timings.append((time.perf_counter() - start) / len(images))
+        results[name] = {"seconds_per_image": min(timings)}
+    baseline = results["numpy_where"]["seconds_per_image"]
+    for result in results.values():
+        result["speedup"] = baseline / result["seconds_per_image"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--images", help="glob of render PNGs to benchmark on")
+    parser.add_argument("--limit", type=int, default=200)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    if args.images:
+        paths = sorted(glob.glob(args.images, recursive=True))[: args.limit]
+        images = [Image.open(path).convert("RGB") for path in paths]
+    else:
+        images = synthetic_renders()
+    print(json.dumps(benchmark(images, args.repeats), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,285 @@
+"""
+Benchmark the serving and data pipelines on synthetic images, and compare to a baseline.
+
+Covers, in groups that can be run separately with --groups:
+    models       building the encoder and decoder, and loading their weights
+    inference    encode and decode latency at batch size 1, and batched throughput
+    preprocess   uploaded_images.preprocess_image, by input image size
+    crop         crop_seeing_3d_chairs_data.crop_to_sizes, images per second on one core
+    hashing      dedupe.hash_image with every hash, images per second on one core
+
+Everything runs on generated images and randomly initialised models, so no dataset,
+weights download or network access is needed. A group whose dependencies aren't
+installed (TensorFlow, imagehash) is skipped.
+
+Results are flat metric names mapping to numbers, where names ending in _seconds are
+better lower and names ending in _per_second are better higher. With --baseline, each
+metric is compared to a previous run's JSON and regressions beyond --tolerance are
+listed, with a non-zero exit status.
+
+Run from the project root directory:
+    python benchmarks/pipeline.py --output benchmarks/baseline.json
+    python benchmarks/pipeline.py --baseline benchmarks/baseline.json --groups preprocess crop
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+PROJECT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for subdirectory in ("hotseats_www", "preprocessing", "scraping"):
+    sys.path.insert(0, os.path.join(PROJECT_DIR, subdirectory))
+
+import autoencoder, uploaded_images  # noqa: E402
+
+
+INPUT_SHAPE = (100, 100, 3)
+ENCODING_DIM = 100
+PREPROCESS_SIZES = (256, 1024, 4000)
+BATCH_SIZES = (16, 64, 256)
+
+
+def best_of(function, repeats=5):
+    """Return the fastest of several timed calls, in seconds."""
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def synthetic_render(rng, size=600):
+    """A white render with a randomly placed block of texture, like a chair render."""
+    img_array = np.full((size, size, 3), 255, dtype=np.uint8)
+    top, left = rng.integers(0, size // 3, size=2)
+    bottom, right = rng.integers(2 * size // 3, size, size=2)
+    img_array[top:bottom, left:right] = rng.integers(
+        0, 250, size=(bottom - top, right - left, 3), dtype=np.uint8
+    )
+    return Image.fromarray(img_array)
+
+
+def synthetic_photo(rng, size):
+    """A smooth gradient with noise, which compresses like a photo."""
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    img_array = np.stack([x, y, (x + y) / 2], axis=-1) * 200
+    img_array += rng.normal(0, 20, img_array.shape)
+    return Image.fromarray(np.clip(img_array, 0, 255).astype(np.uint8))
+
+
+def write_images(directory, images, extension):
+    paths = []
+    for i, img in enumerate(images):
+        path = os.path.join(directory, f"{i:04d}{extension}")
+        img.save(path)
+        paths.append(path)
+    return paths
+
+
+def bench_models(args):
+    encoder_seconds = best_of(
+        lambda: autoencoder.build_encoder_vae(INPUT_SHAPE, ENCODING_DIM), args.repeats
+    )
+    decoder_seconds = best_of(
+        lambda: autoencoder.build_decoder_vae(ENCODING_DIM, INPUT_SHAPE), args.repeats
+    )
+    encoder = autoencoder.build_encoder_vae(INPUT_SHAPE, ENCODING_DIM)
+    decoder = autoencoder.build_decoder_vae(ENCODING_DIM, INPUT_SHAPE)
+    with tempfile.TemporaryDirectory() as directory:
+        encoder_path = os.path.join(directory, "encoder.weights.h5")
+        decoder_path = os.path.join(directory, "decoder.weights.h5")
+        encoder.save_weights(encoder_path)
+        decoder.save_weights(decoder_path)
+        return {
+            "build_encoder_seconds": encoder_seconds,
+            "build_decoder_seconds": decoder_seconds,
+            "load_encoder_weights_seconds": best_of(
+                lambda: encoder.load_weights(encoder_path), args.repeats
+            ),
+            "load_decoder_weights_seconds": best_of(
+                lambda: decoder.load_weights(decoder_path), args.repeats
+            ),
+        }
+
+
+def bench_inference(args):
+    encoder = autoencoder.build_encoder_inference(
+        autoencoder.build_encoder_vae(INPUT_SHAPE, ENCODING_DIM)
+    )
+    decoder = autoencoder.build_decoder_vae(ENCODING_DIM, INPUT_SHAPE)
+    rng = np.random.default_rng(0)
+    results = {}
+    for name, model, shape in (
+        ("encode", encoder, INPUT_SHAPE),
+        ("decode", decoder, (ENCODING_DIM,)),
+    ):
+        for batch_size in (1,) + BATCH_SIZES:
+            batch = rng.random((batch_size,) + shape, dtype=np.float32)
+            # the first call traces the graph
+            model.predict(batch, batch_size=batch_size, verbose=0)
+            seconds = best_of(
+                lambda: model.predict(batch, batch_size=batch_size, verbose=0),
+                args.repeats,
+            )
+            if batch_size == 1:
+                results[f"{name}_latency_seconds"] = seconds
+            else:
+                results[f"{name}_batch{batch_size}_images_per_second"] = batch_size / seconds
+    return results
+
+
+def bench_preprocess(args):
+    rng = np.random.default_rng(0)
+    results = {}
+    for size in PREPROCESS_SIZES:
+        for format_name in ("JPEG", "PNG"):
+            buffer = io.BytesIO()
+            synthetic_photo(rng, size).save(buffer, format=format_name)
+            data = buffer.getvalue()
+            seconds = best_of(
+                lambda: uploaded_images.preprocess_image(io.BytesIO(data)), args.repeats
+            )
+            results[f"preprocess_{format_name.lower()}_{size}px_seconds"] = seconds
+    return results
+
+
+def bench_crop(args):
+    import crop_seeing_3d_chairs_data as crop
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_images(
+            directory, [synthetic_render(rng) for _ in range(args.images)], ".png"
+        )
+
+        def crop_all(sizes):
+            for path in paths:
+                crop.crop_to_sizes(path, sizes)
+
+        return {
+            "crop_256_images_per_second": len(paths)
+            / best_of(lambda: crop_all((256,)), args.repeats),
+            "crop_64_128_256_images_per_second": len(paths)
+            / best_of(lambda: crop_all((64, 128, 256)), args.repeats),
+        }
+
+
+def bench_hashing(args):
+    import dedupe
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_images(
+            directory, [synthetic_photo(rng, 640) for _ in range(args.images)], ".jpg"
+        )
+        results = {}
+        for hash_names in (["average"], sorted(dedupe.HASH_FUNCTIONS)):
+            label = "all" if len(hash_names) > 1 else hash_names[0]
+
+            def hash_all():
+                for path in paths:
+                    dedupe.hash_image(path, hash_names)
+
+            results[f"hash_{label}_images_per_second"] = len(paths) / best_of(
+                hash_all, args.repeats
+            )
+        return results
+
+
+GROUPS = {
+    "models": bench_models,
+    "inference": bench_inference,
+    "preprocess": bench_preprocess,
+    "crop": bench_crop,
+    "hashing": bench_hashing,
+}
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "numpy": np.__version__,
+        "pillow": Image.__version__,
+        "tensorflow": autoencoder.tensorflow_version(),
+    }
+
+
+def compare(metrics, baseline_metrics, tolerance):
+    """
+    Print each metric against the baseline, and return the regressed metric names.
+    """
+    regressions = []
+    for name, value in sorted(metrics.items()):
+        if name not in baseline_metrics:
+            print(f"{name:50s} {value:12.6g}  (new)")
+            continue
+        baseline = baseline_metrics[name]
+        # express every change so that a ratio above 1 is an improvement
+        if name.endswith("_per_second"):
+            ratio = value / baseline
+        else:
+            ratio = baseline / value
+        print(f"{name:50s} {value:12.6g}  {ratio:6.2f}x vs {baseline:.6g}")
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--groups", nargs="+", choices=sorted(GROUPS), default=list(GROUPS)
+    )
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument(
+        "--images", type=int, default=50, help="synthetic images per crop/hash run"
+    )
+    parser.add_argument("--output", help="write the results JSON to this file")
+    parser.add_argument("--baseline", help="results JSON of a previous run")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="fraction a metric may get worse before it counts as a regression",
+    )
+    args = parser.parse_args()
+
+    metrics = {}
+    skipped = {}
+    for group in args.groups:
+        print(f"Running {group} benchmarks", file=sys.stderr)
+        try:
+            metrics.update(GROUPS[group](args))
+        except ImportError as e:
+            print(f"Skipping {group}: {e}", file=sys.stderr)
+            skipped[group] = str(e)
+    results = {"environment": environment(), "skipped": skipped, "metrics": metrics}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if not args.baseline:
+        print(json.dumps(results, indent=2))
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(metrics, baseline["metrics"], args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} metrics regressed: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
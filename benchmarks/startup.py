@@ -0,0 +1,86 @@
+"""
+Measure how long a cold process takes to get the Hot Seats upload page on screen.
+
+Each run starts a fresh Python interpreter, so nothing is already imported. We time
+importing the app's modules, then rendering the app once with Streamlit's testing
+harness, before any images are uploaded. Importing the app must not import TensorFlow.
+
+Run from the project root directory:
+    python benchmarks/startup.py --runs 5
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hotseats_www")
+
+# runs inside the fresh interpreter and prints one JSON line
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+result = {
+    "import_seconds": imported - start,
+    "tensorflow_imported": "tensorflow" in sys.modules,
+}
+try:
+    from streamlit.testing.v1 import AppTest
+except ImportError:
+    pass
+else:
+    render_start = time.perf_counter()
+    AppTest.from_file("app.py", default_timeout=30).run()
+    result["render_seconds"] = time.perf_counter() - render_start
+    result["first_page_seconds"] = time.perf_counter() - start
+print(json.dumps(result))
+"""
+
+
+def run_once():
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=APP_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def summarise(runs):
+    summary = {"runs": len(runs)}
+    for key in ["import_seconds", "render_seconds", "first_page_seconds"]:
+        values = [run[key] for run in runs if key in run]
+        if values:
+            summary[key] = {
+                "median": statistics.median(values),
+                "min": min(values),
+                "max": max(values),
+            }
+    # checked straight after the import, the background warm-up thread loads it
+    # during the render
+    summary["tensorflow_imported"] = any(run["tensorflow_imported"] for run in runs)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="write the summary JSON to this file")
+    args = parser.parse_args()
+
+    summary = summarise([run_once() for _ in range(args.runs)])
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,19 +6,15 @@ and display a new image combining the two images.
 import os
 
 import streamlit as st
-import numpy as np
-import tensorflow as tf
 
-import uploaded_images, autoencoder
-
-
-# set to a local path as needed
-DATASET_VIEWER_DEFAULT_IMAGE_DIRECTORY = None
-DATASET_VIEWER_NUM_IMAGES = 10
+import uploaded_images, autoencoder, model_pool, latent_cache, latent_index, render_cache
+import inference_client, instrumentation
 
 
 def playback_uploaded_image(img_ref: str, default: str = None):
-    """img_ref is e.g. 'one' or 'A'"""
+    """
+    img_ref is e.g. 'one' or 'A'. Returns (image data, preprocessed image), or None.
+    """
     uploaded_file = st.file_uploader(
         f"Choose file {img_ref}", type=["png", "jpg", "jpeg"]
     )
@@ -26,18 +22,20 @@ def playback_uploaded_image(img_ref: str, default: str = None):
         if default is not None:
             st.markdown(f"### Default image {img_ref}")
             st.image(default)
-            return default
+            return default, uploaded_images.load_image(default)
         else:
             return None
     else:
         # Streamlit base64 encodes the images for us, we can give it the in-memory
         # image data.
         # Let's check it's really an image first, not a renamed text file etc.
-        # Streamlit only checks the file extension.
-        if uploaded_images.is_image(uploaded_file):
+        # Streamlit only checks the file extension. The same decode gives the
+        # encoder input.
+        image = uploaded_images.load_image(uploaded_file)
+        if image is not None:
             st.markdown(f"### Uploaded image {img_ref}")
             st.image(uploaded_file)
-            return uploaded_file
+            return uploaded_file, image
         else:
             st.error("Uploaded file is unsupported.")
 
@@ -62,10 +60,11 @@ def main():
         menu_items={"About": "# This is a header. This is a hot seats app!"},
     )
 
-
-
-    # display the tensorflow keras version
-    st.markdown(f"<p style='font-size:12px;'>TensorFlow version: {tf.__version__}</p>", unsafe_allow_html=True)
+    # load TensorFlow and the model pool once per process, in the background, so the
+    # upload page renders straight away. With an inference server, the app never
+    # loads the models itself.
+    if not inference_client.INFERENCE_URL:
+        model_pool.warm_up_in_background()
 
 
     st.markdown("""
@@ -121,16 +120,56 @@ def main():
         return
 
     st.header("Generated Chair")
-    encoder = autoencoder.encoder_model()
-    decoder = autoencoder.decoder_model()
+    if inference_client.INFERENCE_URL:
+        # the server batches our requests with other sessions'
+        encoder, decoder = inference_client.remote_models()
+        render_generated_chairs(encoder, decoder, img_a, img_b)
+        server_info = inference_client.server_info()
+        runtime = server_info["model_runtime"]
+        tensorflow_version = server_info["tensorflow_version"]
+    else:
+        # a pair is only checked out if a cache misses
+        with model_pool.lazy_checkout() as (encoder, decoder):
+            render_generated_chairs(encoder, decoder, img_a, img_b)
+        runtime = autoencoder.MODEL_RUNTIME
+        tensorflow_version = autoencoder.tensorflow_version()
 
-    # TODO: preprocess the uploads
-    _, _, img_a_latent_vector = encoder.predict(
-        np.array([uploaded_images.preprocess_image(img_a)])
-    )
-    _, _, img_b_latent_vector = encoder.predict(
-        np.array([uploaded_images.preprocess_image(img_b)])
+    # display the model runtime, and the tensorflow keras version if it has been
+    # loaded, the TFLite runtime can run without it
+    runtime_text = f"Model runtime: {runtime}"
+    if tensorflow_version is not None:
+        runtime_text += f", TensorFlow version: {tensorflow_version}"
+    st.markdown(f"<p style='font-size:12px;'>{runtime_text}</p>", unsafe_allow_html=True)
+
+
+def weights_version():
+    """Version of the encoder weights, for latent cache keys."""
+    if inference_client.INFERENCE_URL:
+        return inference_client.weights_version()
+    return autoencoder.weights_version()
+
+
+def decoder_weights_version():
+    """Version of the decoder weights, for render cache keys."""
+    if inference_client.INFERENCE_URL:
+        return inference_client.decoder_weights_version()
+    return autoencoder.decoder_weights_version()
+
+
+def render_generated_chairs(encoder, decoder, img_a, img_b):
+    """
+    Encode the two uploads and display the interpolated chairs between them.
+    img_a and img_b are (image data, preprocessed image) pairs.
+    """
+    # cached by the uploaded bytes, so reruns and re-uploads skip the encoder
+    # the pool's encoder is deterministic, so the same upload always gives the same
+    # chairs
+    (data_a, image_a), (data_b, image_b) = img_a, img_b
+    latents_a, latents_b = latent_cache.encode_images(
+        encoder, [data_a, data_b], weights_version(), decoded=[image_a, image_b]
     )
+    img_a_latent_vector = latents_a["z_mean"]
+    img_b_latent_vector = latents_b["z_mean"]
 
     # st.markdown("### Latent vector A")
     # st.write(img_a_latent_vector)
@@ -138,28 +177,58 @@ def main():
     # st.write(img_b_latent_vector)
 
     # Interpolate the latent vectors
+    steps, method = 10, "linear"
     interpolated_latent_vectors = autoencoder.interpolate_latent_vectors(
-        img_a_latent_vector, img_b_latent_vector, steps=10
+        img_a_latent_vector, img_b_latent_vector, steps=steps, method=method
     )
     # st.write(interpolated_latent_vectors[0])
 
+    # Decode the whole strip in one forward pass, unless these endpoints were
+    # rendered before
+    render_key = render_cache.render_key(
+        img_a_latent_vector, img_b_latent_vector, steps, method,
+        decoder_weights_version(),
+    )
+    reconstructed_images = render_cache.decode_strip(
+        decoder, interpolated_latent_vectors, render_key
+    )
+
     # Displaying images in one row
-    cols = st.columns(len(interpolated_latent_vectors))
-    for i, (col, interpolated_encoding) in enumerate(zip(cols, interpolated_latent_vectors)):
-        interpolated_encoding_reshaped = interpolated_encoding.reshape(
-            (1, 100)
-        )  # Reshape to (1, 100)
-        reconstructed_image = decoder.predict(interpolated_encoding_reshaped)
+    cols = st.columns(len(reconstructed_images))
+    for i, (col, reconstructed_image) in enumerate(zip(cols, reconstructed_images)):
         col.image(reconstructed_image, use_column_width=True)
         col.caption(str(i+1))
 
     #create dropdown menu and show image based on selection
-    selected_image = st.selectbox("Select an image", range(1, len(interpolated_latent_vectors)+1), key="image_selection")
+    selected_image = st.selectbox("Select an image", range(1, len(reconstructed_images)+1), key="image_selection")
     selected_image_index = selected_image - 1
-    selected_image_encoding = interpolated_latent_vectors[selected_image_index]
-    selected_image_encoding_reshaped = selected_image_encoding.reshape((1, 100))
-    selected_image_reconstructed = decoder.predict(selected_image_encoding_reshaped)
-    st.image(selected_image_reconstructed, use_column_width=True)
+    st.image(reconstructed_images[selected_image_index], use_column_width=True)
+
+    render_closest_chairs(interpolated_latent_vectors[selected_image_index])
+
+
+def render_closest_chairs(latent_vector, k=5):
+    """
+    Display the real chairs from our dataset nearest the generated one, if the
+    latent index has been built (see latent_index.py).
+    """
+    index = latent_index.get_index(weights_version())
+    if index is None:
+        return
+    matches = [
+        (path, distance)
+        for path, distance in index.search(latent_vector, k=k)
+        if os.path.exists(path)
+    ]
+    if not matches:
+        return
+    st.subheader("Closest real chairs")
+    cols = st.columns(len(matches))
+    for col, (path, distance) in zip(cols, matches):
+        col.image(path, use_column_width=True)
+        col.caption(f"{os.path.basename(path)} ({distance:.2f})")
 
 if __name__ == "__main__":
-    main()
+    with instrumentation.trace("rerun") as rerun_trace:
+        main()
+    instrumentation.render_debug_sidebar(rerun_trace)
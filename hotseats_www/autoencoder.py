@@ -1,55 +1,171 @@
+import functools
+import hashlib
 import os
+import sys
+import time
+from contextlib import contextmanager
+
 import requests
 
-import tensorflow as tf
-from tensorflow import keras
-from tensorflow.keras.layers import (
-    Input,
-    Conv2D,
-    MaxPooling2D,
-    UpSampling2D,
-    Flatten,
-    Reshape,
-    Dense,
-    ZeroPadding2D,
-    Lambda,
-)
-from tensorflow.keras.models import Model
-from tensorflow.keras.losses import binary_crossentropy
-from tensorflow.keras import backend as K
+import numpy as np
+
+import instrumentation
+
+# TensorFlow is imported inside the functions that need it, so that importing this
+# module (e.g. to render the upload page) doesn't pay for loading it.
 
 AE_MODEL_DECODER_WEIGHTS_URL = "https://storage.googleapis.com/chairs-gan-images/autoencoder-models/hotseats-70k-autoencoder_decoder.h5"
 AE_MODEL_ENCODER_WEIGHTS_URL = "https://storage.googleapis.com/chairs-gan-images/autoencoder-models/hotseats-70k-autoencoder_encoder.h5"
 
+# which runtime serves the models: "keras", or the TFLite exports from
+# export_tflite.py, "tflite" or "tflite-int8"
+MODEL_RUNTIMES = ("keras", "tflite", "tflite-int8")
+MODEL_RUNTIME = os.environ.get("HOTSEATS_MODEL_RUNTIME", "keras")
+
+
+# expected sha256 of the weight files, verification is skipped when not set
+AE_MODEL_DECODER_WEIGHTS_SHA256 = os.environ.get("HOTSEATS_DECODER_WEIGHTS_SHA256")
+AE_MODEL_ENCODER_WEIGHTS_SHA256 = os.environ.get("HOTSEATS_ENCODER_WEIGHTS_SHA256")
+
+# (connect, read) timeouts in seconds, the read timeout applies per chunk
+DOWNLOAD_TIMEOUT = (10, 60)
+DOWNLOAD_RETRIES = 4
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
 
 def tmp_dir():
     current_dir = os.path.dirname(os.path.abspath(__file__))
     return os.path.join(current_dir, "tmp")
 
 
-def download_file(url, output_filename):
+def file_sha256(path):
+    """Return the hex sha256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+@contextmanager
+def _file_lock(path):
     """
-    Download a file from the given URL.
+    Hold an exclusive lock on path for the duration of the with-block, across
+    processes. Without fcntl (Windows) we fall back to no locking.
     """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    with open(path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-    # restore weights from saved json
-    # Get the directory of the current Python source code file
-    # Construct the relative path to the encoder weights file
-    output_path = os.path.join(tmp_dir(), output_filename)
 
-    if os.path.exists(output_path):
+def _download_to(url, part_path):
+    """
+    Stream url into part_path, resuming from the bytes already in it if the server
+    supports range requests.
+    """
+    resume_from = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={resume_from}-"} if resume_from else {}
+    with requests.get(
+        url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+    ) as response:
+        if response.status_code == 416:
+            # the part file is already complete, or is larger than the file
+            os.remove(part_path)
+            raise IOError(f"Range request rejected for {url}, restarting")
+        response.raise_for_status()
+        if response.status_code != 206:
+            # the server ignored the range, start again from the beginning
+            resume_from = 0
+        mode = "ab" if resume_from else "wb"
+        expected_size = None
+        if "Content-Encoding" not in response.headers:
+            # with compression, Content-Length is not the size we write
+            expected_size = response.headers.get("Content-Length")
+        written = 0
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                f.write(chunk)
+                written += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+    if expected_size is not None and written != int(expected_size):
+        raise IOError(
+            f"Download of {url} was cut short: got {written} of {expected_size} bytes"
+        )
+
+
+@instrumentation.timed("download_file")
+def download_file(url, output_filename, sha256=None, directory=None):
+    """
+    Download a file from the given URL, unless it is already in the directory
+    (tmp_dir() by default).
+
+    The file is streamed to a .part file and renamed into place once complete, so a
+    crash never leaves a truncated file behind to be mistaken for the real one.
+    A lock file makes sure only one process downloads at a time, and interrupted
+    downloads are resumed and retried. If sha256 is given the download, and any
+    existing file, must match it.
+    """
+    directory = directory or tmp_dir()
+    output_path = os.path.join(directory, output_filename)
+
+    if _is_valid_download(output_path, sha256):
         return
 
-    response = requests.get(url, timeout=10)
-    response.raise_for_status()
-    with open(output_path, "wb") as f:
-        f.write(response.content)
+    with _file_lock(output_path + ".lock"):
+        # another process may have finished the download while we waited
+        if _is_valid_download(output_path, sha256):
+            return
+
+        part_path = output_path + ".part"
+        for attempt in range(DOWNLOAD_RETRIES):
+            try:
+                _download_to(url, part_path)
+                if sha256 is not None and file_sha256(part_path) != sha256:
+                    os.remove(part_path)
+                    raise IOError(f"Checksum mismatch for {url}")
+                break
+            except (IOError, requests.RequestException):
+                if attempt == DOWNLOAD_RETRIES - 1:
+                    raise
+                time.sleep(2**attempt)
+
+        os.replace(part_path, output_path)
+        _verified_downloads.add(output_path)
+
+
+_verified_downloads = set()
+
+
+def _is_valid_download(output_path, sha256):
+    """
+    Whether output_path exists and matches the checksum. Each file is only hashed
+    once per process, not on every rerun.
+    """
+    if not os.path.exists(output_path):
+        return False
+    if sha256 is None or output_path in _verified_downloads:
+        return True
+    if file_sha256(output_path) == sha256:
+        _verified_downloads.add(output_path)
+        return True
+    os.remove(output_path)
+    return False
 
 
 # do not cache this because the models are not thread-safe
 # https://docs.streamlit.io/library/api-reference/performance/st.cache_resource
 # https://docs.streamlit.io/library/advanced-features/caching#deciding-which-caching-decorator-to-use
 # downloading the file once and reusing it already "caches" the download step
+# model_pool.py keeps warm instances for the app, each used by one request at a time
 def encoder_model():
     """
     Load the pre-trained encoder model.
@@ -59,18 +175,35 @@ def encoder_model():
     encoding_dim = 100  # Example encoding dimension
 
     # initialise encoder model
-    encoder = build_encoder_vae(input_shape, encoding_dim)
+    with instrumentation.span("build_encoder"):
+        encoder = build_encoder_vae(input_shape, encoding_dim)
 
     # restore weights from saved json
-    download_file(AE_MODEL_ENCODER_WEIGHTS_URL, "encoder_weights.h5")
-    encoder.load_weights(os.path.join(tmp_dir(), "encoder_weights.h5"))
+    download_file(
+        AE_MODEL_ENCODER_WEIGHTS_URL,
+        "encoder_weights.h5",
+        sha256=AE_MODEL_ENCODER_WEIGHTS_SHA256,
+    )
+    with instrumentation.span("load_encoder_weights"):
+        encoder.load_weights(os.path.join(tmp_dir(), "encoder_weights.h5"))
     return encoder
 
 
+def inference_encoder_model():
+    """
+    Load the pre-trained encoder, without the sampling branch.
+
+    The returned model maps images straight to z_mean, so it is deterministic and
+    skips the z_log_var head and the random draw. This is what we serve.
+    """
+    return build_encoder_inference(encoder_model())
+
+
 # do not cache this because the models are not thread-safe
 # https://docs.streamlit.io/library/api-reference/performance/st.cache_resource
 # https://docs.streamlit.io/library/advanced-features/caching#deciding-which-caching-decorator-to-use
 # downloading the file once and reusing it already "caches" the download step
+# model_pool.py keeps warm instances for the app, each used by one request at a time
 def decoder_model():
     """
     Load the pre-trained decoder model.
@@ -80,16 +213,99 @@ def decoder_model():
     encoding_dim = 100  # Example encoding dimension
 
     # initialise decoder model
-    decoder = build_decoder_vae(encoding_dim, input_shape)
+    with instrumentation.span("build_decoder"):
+        decoder = build_decoder_vae(encoding_dim, input_shape)
 
     # restore weights from saved json
-    download_file(AE_MODEL_DECODER_WEIGHTS_URL, "decoder_weights.h5")
-    decoder.load_weights(os.path.join(tmp_dir(), "decoder_weights.h5"))
+    download_file(
+        AE_MODEL_DECODER_WEIGHTS_URL,
+        "decoder_weights.h5",
+        sha256=AE_MODEL_DECODER_WEIGHTS_SHA256,
+    )
+    with instrumentation.span("load_decoder_weights"):
+        decoder.load_weights(os.path.join(tmp_dir(), "decoder_weights.h5"))
     return decoder
 
 
+def serving_models(runtime=MODEL_RUNTIME):
+    """
+    Load the (encoder, decoder) pair the app serves, using the given runtime.
+
+    Both models have a predict(batch) method, the encoder returning z_mean only.
+    """
+    if runtime not in MODEL_RUNTIMES:
+        raise ValueError(
+            f"Unknown model runtime {runtime!r}, expected one of {MODEL_RUNTIMES}"
+        )
+    if runtime == "keras":
+        return inference_encoder_model(), decoder_model()
+
+    import lite_models
+
+    return lite_models.load_pair(quantized=runtime == "tflite-int8")
+
+
+def served_weights_path(model, runtime=MODEL_RUNTIME):
+    """
+    Return the path of the weights the runtime serves for model, "encoder" or
+    "decoder". For the Keras runtime the .h5 file is downloaded if needed, the TFLite
+    runtimes serve the exports in the tmp directory.
+    """
+    if runtime == "keras":
+        url, filename, sha256 = {
+            "encoder": (
+                AE_MODEL_ENCODER_WEIGHTS_URL,
+                "encoder_weights.h5",
+                AE_MODEL_ENCODER_WEIGHTS_SHA256,
+            ),
+            "decoder": (
+                AE_MODEL_DECODER_WEIGHTS_URL,
+                "decoder_weights.h5",
+                AE_MODEL_DECODER_WEIGHTS_SHA256,
+            ),
+        }[model]
+        download_file(url, filename, sha256=sha256)
+        return os.path.join(tmp_dir(), filename)
+
+    import lite_models
+
+    encoder_path, decoder_path = lite_models.model_paths(
+        quantized=runtime == "tflite-int8"
+    )
+    return encoder_path if model == "encoder" else decoder_path
+
+
+@functools.lru_cache(maxsize=None)
+def weights_version():
+    """
+    Return a short fingerprint of the served encoder, used to key cached latents.
+
+    Quantized models give slightly different encodings, so the runtime is included.
+    """
+    digest = file_sha256(served_weights_path("encoder"))
+    return f"{digest[:16]}-{MODEL_RUNTIME}"
+
+
+@functools.lru_cache(maxsize=None)
+def decoder_weights_version():
+    """
+    Return a short fingerprint of the served decoder, used to key cached renders.
+    """
+    digest = file_sha256(served_weights_path("decoder"))
+    return f"{digest[:16]}-{MODEL_RUNTIME}"
+
+
+def tensorflow_version():
+    """Return the TensorFlow version if it has been loaded, without importing it."""
+    tf = sys.modules.get("tensorflow")
+    return getattr(tf, "__version__", None)
+
+
 def sampling(args):
     """Reparametrization trick z-mu +sigma +epsilon"""
+    import tensorflow as tf
+    from tensorflow.keras import backend as K
+
     z_mean, z_log_var = args
     batch = tf.shape(z_mean)[0]
     dim = tf.shape(z_mean)[1]
@@ -98,6 +314,16 @@ def sampling(args):
 
 
 def build_encoder_vae(input_shape, encoding_dim):
+    from tensorflow.keras.layers import (
+        Input,
+        Conv2D,
+        MaxPooling2D,
+        Flatten,
+        Dense,
+        Lambda,
+    )
+    from tensorflow.keras.models import Model
+
     input_img = Input(shape=input_shape)
     x = Conv2D(32, (3, 3), activation="relu", padding="same")(input_img)
     x = MaxPooling2D((2, 2), padding="same")(x)
@@ -112,7 +338,29 @@ def build_encoder_vae(input_shape, encoding_dim):
     return Model(input_img, [z_mean, z_log_var, z])
 
 
+def build_encoder_inference(encoder):
+    """
+    Return a model sharing the encoder's layers and weights that outputs only z_mean.
+
+    Keras only keeps the layers needed for the requested output, so the z_log_var
+    Dense layer and the sampling Lambda are not run.
+    """
+    from tensorflow.keras.models import Model
+
+    return Model(encoder.input, encoder.get_layer("z_mean").output)
+
+
 def build_decoder_vae(encoded_dim, input_shape):
+    from tensorflow.keras.layers import (
+        Input,
+        Conv2D,
+        UpSampling2D,
+        Reshape,
+        Dense,
+        ZeroPadding2D,
+    )
+    from tensorflow.keras.models import Model
+
     input_encoded = Input(shape=(encoded_dim,))
     x = Dense(12 * 12 * 128, activation="relu")(
         input_encoded
@@ -135,11 +383,116 @@ def build_decoder_vae(encoded_dim, input_shape):
     return Model(input_encoded, decoded)
 
 
-def interpolate_latent_vectors(encoding1, encoding2, steps=10):
-    # Interpolate between the encodings
-    interpolated_encodings = []
-    for i in range(steps):
-        alpha = i / steps
-        interpolated_encoding = alpha * encoding2 + (1 - alpha) * encoding1
-        interpolated_encodings.append(interpolated_encoding)
-    return interpolated_encodings
+INTERPOLATION_METHODS = ("linear", "slerp")
+
+
+def interpolation_alphas(steps, endpoint=False, dtype=np.float32):
+    """
+    Return the blend factors for a strip of the given length, as a (steps, 1) column.
+
+    Without the end point the strip stops one step short of the second encoding,
+    which is what the app has always shown.
+    """
+    alphas = np.linspace(0.0, 1.0, num=steps, endpoint=endpoint, dtype=dtype)
+    return alphas.reshape(-1, 1)
+
+
+def lerp(encoding1, encoding2, alphas, out=None):
+    """
+    Linear interpolation of two (1, dim) encodings for each row of alphas.
+
+    Pass a preallocated (steps, dim) array as out to avoid allocating the result.
+    """
+    out = np.multiply(alphas, encoding2 - encoding1, out=out)
+    out += encoding1
+    return out
+
+
+def slerp(encoding1, encoding2, alphas, out=None):
+    """
+    Spherical interpolation of two (1, dim) encodings for each row of alphas.
+
+    The path follows the arc between the two vectors, falling back to linear
+    interpolation when they are (nearly) parallel.
+    """
+    norm1 = np.linalg.norm(encoding1)
+    norm2 = np.linalg.norm(encoding2)
+    if norm1 == 0 or norm2 == 0:
+        return lerp(encoding1, encoding2, alphas, out=out)
+    cos_omega = np.clip(np.sum(encoding1 * encoding2) / (norm1 * norm2), -1.0, 1.0)
+    omega = np.arccos(cos_omega)
+    sin_omega = np.sin(omega)
+    if sin_omega < 1e-6:
+        return lerp(encoding1, encoding2, alphas, out=out)
+
+    weights2 = np.sin(alphas * omega) / sin_omega
+    weights1 = np.sin((1.0 - alphas) * omega) / sin_omega
+    out = np.multiply(weights1, encoding1, out=out)
+    out += weights2 * encoding2
+    return out
+
+
+def barycentric_blend(anchors, weights, out=None):
+    """
+    Blend more than two encodings.
+
+    anchors is a (n_anchors, dim) array of encodings, weights a (steps, n_anchors)
+    array with one row of blend weights per output vector. Each row is normalised to
+    sum to 1, so the result stays inside the convex hull of the anchors.
+    """
+    anchors = np.asarray(anchors)
+    weights = np.asarray(weights, dtype=anchors.dtype)
+    if weights.ndim != 2 or weights.shape[1] != anchors.shape[0]:
+        raise ValueError(
+            f"Expected weights of shape (steps, {anchors.shape[0]}), got {weights.shape}"
+        )
+    totals = weights.sum(axis=1, keepdims=True)
+    if np.any(totals == 0):
+        raise ValueError("Each row of blend weights must have a non-zero sum")
+    return np.matmul(weights / totals, anchors, out=out)
+
+
+def anchor_path_weights(n_anchors, steps_per_segment=10, endpoint=True):
+    """
+    Return blend weights for a strip that walks through each anchor in turn.
+
+    The result can be passed to barycentric_blend, and has
+    (n_anchors - 1) * steps_per_segment rows, plus one for the end point.
+    """
+    if n_anchors < 2:
+        raise ValueError("Need at least two anchors to interpolate between")
+    alphas = interpolation_alphas(steps_per_segment).ravel()
+    n_rows = (n_anchors - 1) * steps_per_segment + int(endpoint)
+    weights = np.zeros((n_rows, n_anchors), dtype=np.float32)
+    rows = np.arange(steps_per_segment)
+    for segment in range(n_anchors - 1):
+        segment_rows = rows + segment * steps_per_segment
+        weights[segment_rows, segment] = 1.0 - alphas
+        weights[segment_rows, segment + 1] = alphas
+    if endpoint:
+        weights[-1, -1] = 1.0
+    return weights
+
+
+def interpolate_latent_vectors(
+    encoding1, encoding2, steps=10, method="linear", endpoint=False, out=None
+):
+    """
+    Interpolate between two encodings, returning a (steps, encoding_dim) array that
+    can be passed to decoder.predict as a single batch.
+
+    method is "linear" or "slerp". Set endpoint to include encoding2 itself as the
+    last step.
+    """
+    if method not in INTERPOLATION_METHODS:
+        raise ValueError(
+            f"Unknown interpolation method {method!r}, expected one of {INTERPOLATION_METHODS}"
+        )
+    encoding1 = np.reshape(encoding1, (1, -1))
+    encoding2 = np.reshape(encoding2, (1, -1))
+    alphas = interpolation_alphas(
+        steps, endpoint=endpoint, dtype=np.result_type(encoding1, np.float32)
+    )
+    if method == "slerp":
+        return slerp(encoding1, encoding2, alphas, out=out)
+    return lerp(encoding1, encoding2, alphas, out=out)
@@ -0,0 +1,209 @@
+"""
+Generate interpolation strips for many chair pairs at once, without the Streamlit UI.
+
+Pairs come from a CSV manifest with two image paths per row (relative paths are
+resolved against the manifest's directory), or from every pair of images in a
+directory. Each unique image is preprocessed and encoded once, in large batches, and
+the strips are decoded in batches too. Each strip is written as one PNG, with the
+frames side by side.
+
+Run from the hotseats_www directory, e.g.:
+    python batch_interpolate.py --directory ../raw_data/pairs --output-dir ../raw_data/strips
+    python batch_interpolate.py --manifest pairs.csv --output-dir strips --batch-size 512
+"""
+
+import argparse
+import csv
+import hashlib
+import itertools
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import autoencoder, uploaded_images
+
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+
+
+def pairs_from_manifest(manifest_path):
+    """Read (image_a, image_b) path pairs from a two-column CSV file."""
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    pairs = []
+    with open(manifest_path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or row[0].startswith("#"):
+                continue
+            pairs.append(
+                tuple(os.path.join(base_dir, path.strip()) for path in row[:2])
+            )
+    return pairs
+
+
+def pairs_from_directory(directory):
+    """Return every pair of images in the directory."""
+    images = sorted(
+        os.path.join(directory, filename)
+        for filename in os.listdir(directory)
+        if filename.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return list(itertools.combinations(images, 2))
+
+
+def batches(items, batch_size):
+    for i in range(0, len(items), batch_size):
+        yield items[i : i + batch_size]
+
+
+def _preprocess_or_none(path):
+    try:
+        return uploaded_images.preprocess_image(path)
+    except (ValueError, OSError) as e:
+        print(f"Skipping {path}: {e}", file=sys.stderr)
+        return None
+
+
+def encode_images(encoder, paths, batch_size, workers):
+    """
+    Encode each image once, returning a dict of path to z_mean. Images that can't
+    be read are left out.
+    """
+    latents = {}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch_paths in batches(paths, batch_size):
+            # PIL releases the GIL while decoding, so threads help here
+            images = list(executor.map(_preprocess_or_none, batch_paths))
+            readable = [
+                (path, image)
+                for path, image in zip(batch_paths, images)
+                if image is not None
+            ]
+            if not readable:
+                continue
+            batch = np.stack([image for _, image in readable])
+            encodings = encoder.predict(batch, batch_size=len(batch), verbose=0)
+            for (path, _), encoding in zip(readable, encodings):
+                latents[path] = encoding
+            done = len(latents)
+            elapsed = time.perf_counter() - start
+            print(
+                f"Encoded {done}/{len(paths)} images, {done / elapsed:.1f} images/s"
+            )
+    return latents
+
+
+def strip_filename(path_a, path_b):
+    """
+    Name a strip after its two images, with a short hash of their full paths, so
+    pairs of same-named images from different directories don't overwrite each other.
+    """
+    stem_a = os.path.splitext(os.path.basename(path_a))[0]
+    stem_b = os.path.splitext(os.path.basename(path_b))[0]
+    digest = hashlib.sha256(
+        f"{os.path.abspath(path_a)}\0{os.path.abspath(path_b)}".encode()
+    ).hexdigest()[:10]
+    return f"{stem_a}__{stem_b}-{digest}.png"
+
+
+def save_strip(frames, output_path):
+    """Write a (steps, height, width, 3) array of [0, 1] floats as one PNG."""
+    strip = np.concatenate(list(frames), axis=1)
+    strip = np.clip(strip * 255.0 + 0.5, 0, 255).astype(np.uint8)
+    Image.fromarray(strip).save(output_path)
+
+
+def decode_strips(decoder, pairs, latents, output_dir, args):
+    """
+    Decode the strips for all pairs, several pairs per decoder.predict call.
+    """
+    pairs_per_batch = max(1, args.batch_size // args.steps)
+    start = time.perf_counter()
+    written = 0
+    for batch_pairs in batches(pairs, pairs_per_batch):
+        strip_latents = np.concatenate(
+            [
+                autoencoder.interpolate_latent_vectors(
+                    latents[path_a],
+                    latents[path_b],
+                    steps=args.steps,
+                    method=args.method,
+                    endpoint=args.endpoint,
+                )
+                for path_a, path_b in batch_pairs
+            ]
+        )
+        frames = decoder.predict(
+            strip_latents, batch_size=len(strip_latents), verbose=0
+        )
+        for i, (path_a, path_b) in enumerate(batch_pairs):
+            save_strip(
+                frames[i * args.steps : (i + 1) * args.steps],
+                os.path.join(output_dir, strip_filename(path_a, path_b)),
+            )
+        written += len(batch_pairs)
+        elapsed = time.perf_counter() - start
+        print(
+            f"Wrote {written}/{len(pairs)} strips, "
+            f"{written / elapsed:.1f} strips/s, "
+            f"{written * args.steps / elapsed:.1f} frames/s"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--manifest", help="CSV file of image_a,image_b rows")
+    source.add_argument("--directory", help="interpolate every pair in this directory")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument(
+        "--method", choices=autoencoder.INTERPOLATION_METHODS, default="linear"
+    )
+    parser.add_argument(
+        "--endpoint", action="store_true", help="end each strip on the second image"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=256,
+        help="images per encoder call, and frames per decoder call",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count(),
+        help="threads used to decode and resize the input images",
+    )
+    args = parser.parse_args()
+    if args.steps < 1:
+        parser.error("--steps must be at least 1")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+
+    if args.manifest:
+        pairs = pairs_from_manifest(args.manifest)
+    else:
+        pairs = pairs_from_directory(args.directory)
+    unique_paths = sorted(set(itertools.chain.from_iterable(pairs)))
+    print(f"{len(pairs)} pairs of {len(unique_paths)} images")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    encoder, decoder = autoencoder.serving_models()
+    latents = encode_images(encoder, unique_paths, args.batch_size, args.workers)
+    readable_pairs = [
+        (path_a, path_b)
+        for path_a, path_b in pairs
+        if path_a in latents and path_b in latents
+    ]
+    if len(readable_pairs) < len(pairs):
+        print(f"Skipping {len(pairs) - len(readable_pairs)} pairs with unreadable images")
+    decode_strips(decoder, readable_pairs, latents, args.output_dir, args)
+
+
+if __name__ == "__main__":
+    main()
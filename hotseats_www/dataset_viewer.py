@@ -1,19 +1,184 @@
+"""
+Browse a directory of PNG training images, a page or a random sample at a time.
+
+The processed datasets hold tens of thousands of images, so the viewer never lists or
+decodes the whole directory on a rerun. The PNG filenames are kept in an index file,
+rescanned with os.scandir only when the directory's modification time changes (i.e.
+files were added or removed). The rescan is diffed against the index, so only the
+added filenames are merged in, and the thumbnails of removed files are deleted. Only
+the visible images are read, as small thumbnails cached on disk and regenerated when
+their source image changes.
+
+The index and thumbnails live in HOTSEATS_THUMBNAIL_CACHE_DIR, or a "thumbnails"
+directory next to the downloaded model weights.
+"""
+
+import hashlib
+import heapq
+import json
 import os
+import random
+
 from PIL import Image
 import streamlit as st
 
+import autoencoder
+
+
+# set to a local path as needed
+DATASET_VIEWER_DEFAULT_IMAGE_DIRECTORY = None
+DATASET_VIEWER_NUM_IMAGES = 10
+THUMBNAIL_SIZE = (128, 128)
+THUMBNAIL_CACHE_DIR = os.environ.get("HOTSEATS_THUMBNAIL_CACHE_DIR")
+INDEX_FILENAME = "index.json"
+
+# directory -> index, so reruns in this process skip reading the index file
+_indexes = {}
+
+
+def cache_dir_for(directory_path):
+    """Return the index and thumbnail directory for an image directory."""
+    base = THUMBNAIL_CACHE_DIR or os.path.join(autoencoder.tmp_dir(), "thumbnails")
+    key = hashlib.sha256(os.path.abspath(directory_path).encode()).hexdigest()[:16]
+    return os.path.join(base, key)
+
+
+def iter_png_filenames(directory_path):
+    """Yield the PNG filenames in the directory, without stat-ing every file."""
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            if entry.name.endswith(".png") and entry.is_file():
+                yield entry.name
+
 
-def load_png_images_from_directory(directory_path, num_images=10):
-    images = []
-    for filename in os.listdir(directory_path)[:num_images]:
-        if filename.endswith(".png"):
-            img_path = os.path.join(directory_path, filename)
+def scan_png_filenames(directory_path):
+    """Return the sorted PNG filenames in the directory."""
+    return sorted(iter_png_filenames(directory_path))
+
+
+def diff_filenames(filenames, scanned):
+    """
+    Return (filenames updated to the scanned ones, removed filenames). filenames is
+    the sorted cached list, only the added names are sorted and merged into it.
+    """
+    scanned = set(scanned)
+    removed = [filename for filename in filenames if filename not in scanned]
+    if removed:
+        filenames = [filename for filename in filenames if filename in scanned]
+    added = sorted(scanned.difference(filenames))
+    if added:
+        filenames = list(heapq.merge(filenames, added))
+    return filenames, removed
+
+
+def remove_thumbnails(directory_path, filenames):
+    """Delete the cached thumbnails of the filenames, at every size."""
+    try:
+        size_dirs = [
+            entry.path
+            for entry in os.scandir(cache_dir_for(directory_path))
+            if entry.is_dir()
+        ]
+    except OSError:
+        return
+    for size_dir in size_dirs:
+        for filename in filenames:
             try:
-                img = Image.open(img_path)
-                images.append(img)
-            except Exception as e:
-                print(f"Error loading image {filename}: {e}")
-    return images
+                os.remove(os.path.join(size_dir, filename))
+            except OSError:
+                pass
+
+
+def _save_index(path, index):
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f)
+    os.replace(path + ".tmp", path)
+
+
+def load_index(directory_path):
+    """
+    Return the sorted PNG filenames in the directory, from the in-process or on-disk
+    index if the directory hasn't changed since it was built.
+    """
+    mtime_ns = os.stat(directory_path).st_mtime_ns
+    index = _indexes.get(directory_path)
+    index_path = os.path.join(cache_dir_for(directory_path), INDEX_FILENAME)
+    if index is None:
+        try:
+            with open(index_path) as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = None
+    if index is None:
+        index = {"mtime_ns": mtime_ns, "filenames": scan_png_filenames(directory_path)}
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        _save_index(index_path, index)
+    elif index["mtime_ns"] != mtime_ns:
+        filenames, removed = diff_filenames(
+            index["filenames"], iter_png_filenames(directory_path)
+        )
+        remove_thumbnails(directory_path, removed)
+        index = {"mtime_ns": mtime_ns, "filenames": filenames}
+        _save_index(index_path, index)
+    _indexes[directory_path] = index
+    return index["filenames"]
+
+
+def load_thumbnail(directory_path, filename, size=THUMBNAIL_SIZE):
+    """
+    Return a thumbnail of the image, from the disk cache unless the image is newer.
+    """
+    img_path = os.path.join(directory_path, filename)
+    thumbnail_path = os.path.join(
+        cache_dir_for(directory_path), f"{size[0]}x{size[1]}", filename
+    )
+    try:
+        if os.stat(thumbnail_path).st_mtime_ns >= os.stat(img_path).st_mtime_ns:
+            # copy, so the file is read and closed now rather than left open
+            with Image.open(thumbnail_path) as thumbnail:
+                return thumbnail.copy()
+    except OSError:
+        pass
+    with Image.open(img_path) as img:
+        img.draft("RGB", size)
+        img.thumbnail(size)
+        thumbnail = img.convert("RGB")
+    os.makedirs(os.path.dirname(thumbnail_path), exist_ok=True)
+    thumbnail.save(thumbnail_path + ".tmp", format="PNG")
+    os.replace(thumbnail_path + ".tmp", thumbnail_path)
+    return thumbnail
+
+
+def page_of(filenames, page, page_size):
+    """Return the filenames on a zero-based page."""
+    return filenames[page * page_size : (page + 1) * page_size]
+
+
+def sample_of(filenames, count, seed=None):
+    """Return a random sample of filenames, across the whole dataset."""
+    return random.Random(seed).sample(filenames, min(count, len(filenames)))
+
+
+def load_png_images_from_directory(directory_path, num_images=10, page=0):
+    """
+    Return (filename, thumbnail) pairs for one page of the PNG images in the
+    directory.
+    """
+    filenames = page_of(load_index(directory_path), page, num_images)
+    return load_thumbnails(directory_path, filenames)
+
+
+def load_thumbnails(directory_path, filenames):
+    """
+    Return (filename, thumbnail) pairs, leaving out images that can't be read.
+    """
+    thumbnails = []
+    for filename in filenames:
+        try:
+            thumbnails.append((filename, load_thumbnail(directory_path, filename)))
+        except Exception as e:
+            print(f"Error loading image {filename}: {e}")
+    return thumbnails
 
 
 def render_image_dataset_viewer(
@@ -36,21 +201,35 @@ def render_image_dataset_viewer(
             "Enter the directory path containing PNG images", ""
         )
         num_images_to_display = st.number_input(
-            "Number of images to display", min_value=1, value=5, max_value=10, step=1
+            "Number of images to display", min_value=1, value=5, max_value=50, step=1
         )
 
-    if image_directory:
-        images = image_dataset.load_png_images_from_directory(
-            directory_path=image_directory, num_images=num_images_to_display
-        )
-        if images:
+    if image_directory and os.path.isdir(image_directory):
+        filenames = load_index(image_directory)
+        view = st.radio("Show:", ("Pages", "Random sample"), horizontal=True)
+        if view == "Pages":
+            page_count = max(1, -(-len(filenames) // num_images_to_display))
+            page = st.number_input(
+                f"Page (of {page_count})", min_value=1, max_value=page_count, value=1
+            )
+            shown = page_of(filenames, page - 1, num_images_to_display)
+        else:
+            if st.button("New sample") or "dataset_viewer_seed" not in st.session_state:
+                st.session_state["dataset_viewer_seed"] = random.randrange(2**32)
+            shown = sample_of(
+                filenames, num_images_to_display, st.session_state["dataset_viewer_seed"]
+            )
+        thumbnails = load_thumbnails(image_directory, shown)
+        if thumbnails:
+            st.caption(f"{len(filenames)} PNG images in {image_directory}")
             st.image(
-                images,
-                caption=[f"Image {i+1}" for i in range(len(images))],
-                use_column_width=True,
+                [thumbnail for _, thumbnail in thumbnails],
+                caption=[filename for filename, _ in thumbnails],
             )
         else:
             st.write("No PNG images found in the specified directory.")
+    elif image_directory:
+        st.error(f"{image_directory} is not a directory.")
     else:
         st.error("No image directory provided, and no default set.")
 
@@ -0,0 +1,192 @@
+"""
+Export the served encoder and decoder to TensorFlow Lite, and report how far the
+exported models drift from the Keras outputs.
+
+Two variants are written to the tmp directory: a float32 conversion, and an int8
+post-training quantized one. The int8 activation ranges are calibrated on a random
+sample of the processed dataset, and on interpolations between their encodings. The
+drift is measured on the sample chairs in static/, which are not in the calibration
+set.
+
+Run from the hotseats_www directory:
+    python export_tflite.py --calibration-dir ../raw_data/processed_data/seeing_3d_chairs_cropped_256x256
+Then start the app with HOTSEATS_MODEL_RUNTIME=tflite or tflite-int8.
+"""
+
+import argparse
+import glob
+import json
+import os
+import random
+import time
+
+import numpy as np
+import tensorflow as tf
+
+import autoencoder, lite_models, uploaded_images
+
+
+CALIBRATION_SIZE = 500
+CALIBRATION_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def sample_images():
+    """Return the sample chairs in static/ as a preprocessed batch."""
+    static_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+    paths = sorted(
+        glob.glob(os.path.join(static_dir, "*.png"))
+        + glob.glob(os.path.join(static_dir, "*.jpg"))
+    )
+    return np.array([uploaded_images.preprocess_image(path) for path in paths])
+
+
+def calibration_images(directory, count=CALIBRATION_SIZE, seed=0):
+    """
+    Return a random sample of count images from the directory as a preprocessed
+    batch. Images that can't be read are left out.
+    """
+    with os.scandir(directory) as entries:
+        paths = sorted(
+            entry.path
+            for entry in entries
+            if entry.name.lower().endswith(CALIBRATION_EXTENSIONS)
+        )
+    images = []
+    for path in random.Random(seed).sample(paths, min(count, len(paths))):
+        try:
+            images.append(uploaded_images.preprocess_image(path))
+        except (ValueError, OSError) as e:
+            print(f"Skipping {path}: {e}")
+    if not images:
+        raise ValueError(f"No readable images in {directory}")
+    return np.array(images)
+
+
+def sample_encodings(encoder, images, steps=10):
+    """Encode the sample chairs, and interpolate between each consecutive pair."""
+    encodings = encoder.predict(images)
+    strips = [encodings]
+    for encoding1, encoding2 in zip(encodings[:-1], encodings[1:]):
+        strips.append(
+            autoencoder.interpolate_latent_vectors(encoding1, encoding2, steps=steps)
+        )
+    return np.concatenate(strips).astype(np.float32)
+
+
+def convert(model, calibration_data=None):
+    """
+    Convert a Keras model to a TFLite flatbuffer.
+
+    With calibration data, weights and activations are quantized to int8. The model
+    inputs and outputs stay float32, so callers don't need to know the scales.
+    """
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if calibration_data is not None:
+
+        def representative_dataset():
+            for sample in calibration_data:
+                yield [sample[np.newaxis].astype(np.float32)]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    return converter.convert()
+
+
+def compare(keras_model, lite_model, inputs, repeats=5):
+    """
+    Return the error and speed of a TFLite model relative to the Keras model.
+    """
+    expected = keras_model.predict(inputs, verbose=0)
+    actual = lite_model.predict(inputs)
+
+    def best_time(model):
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            model.predict(inputs)
+            timings.append(time.perf_counter() - start)
+        return min(timings)
+
+    keras_seconds = best_time(keras_model)
+    lite_seconds = best_time(lite_model)
+    error = np.abs(actual - expected)
+    return {
+        "batch_size": len(inputs),
+        "mean_abs_error": float(error.mean()),
+        "max_abs_error": float(error.max()),
+        "rmse": float(np.sqrt(np.mean(np.square(actual - expected)))),
+        "keras_seconds": keras_seconds,
+        "tflite_seconds": lite_seconds,
+        "speedup": keras_seconds / lite_seconds if lite_seconds else None,
+        "model_bytes": os.path.getsize(lite_model.model_path),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--no-int8",
+        action="store_true",
+        help="only write the float32 models",
+    )
+    parser.add_argument(
+        "--calibration-dir",
+        help="directory of processed chair images to calibrate the int8 models on",
+    )
+    parser.add_argument(
+        "--calibration-size",
+        type=int,
+        default=CALIBRATION_SIZE,
+        help="number of images sampled from --calibration-dir",
+    )
+    parser.add_argument(
+        "--report",
+        default=os.path.join(autoencoder.tmp_dir(), "tflite_report.json"),
+        help="where to write the accuracy report",
+    )
+    args = parser.parse_args()
+    if not args.no_int8 and not args.calibration_dir:
+        parser.error(
+            "--calibration-dir is required for the int8 export, or pass --no-int8"
+        )
+
+    encoder = autoencoder.inference_encoder_model()
+    decoder = autoencoder.decoder_model()
+    images = sample_images()
+    encodings = sample_encodings(encoder, images)
+
+    variants = [(False, None, None)]
+    if not args.no_int8:
+        calibration = calibration_images(args.calibration_dir, args.calibration_size)
+        print(f"Calibrating on {len(calibration)} images from {args.calibration_dir}")
+        variants.append(
+            (True, calibration, sample_encodings(encoder, calibration, steps=4))
+        )
+
+    report = {}
+    for quantized, encoder_calibration, decoder_calibration in variants:
+        name = "int8" if quantized else "float32"
+        encoder_path, decoder_path = lite_models.model_paths(quantized)
+        for model, path, calibration in [
+            (encoder, encoder_path, encoder_calibration),
+            (decoder, decoder_path, decoder_calibration),
+        ]:
+            print(f"Converting {path}")
+            with open(path, "wb") as f:
+                f.write(convert(model, calibration))
+
+        lite_encoder, lite_decoder = lite_models.load_pair(quantized)
+        report[name] = {
+            "encoder": compare(encoder, lite_encoder, images),
+            "decoder": compare(decoder, lite_decoder, encodings),
+        }
+
+    print(json.dumps(report, indent=2))
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.report}")
+
+
+if __name__ == "__main__":
+    main()
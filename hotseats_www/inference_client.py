@@ -0,0 +1,80 @@
+"""
+A thin client for inference_server.py, used by the app when HOTSEATS_INFERENCE_URL
+is set.
+
+RemoteModel has the predict() method of a Keras model, so the remote encoder and
+decoder drop into latent_cache.encode_images and render_cache.decode_strip unchanged,
+and the app never imports TensorFlow or downloads the weights.
+"""
+
+import io
+import os
+import threading
+import time
+
+import numpy as np
+import requests
+
+
+INFERENCE_URL = os.environ.get("HOTSEATS_INFERENCE_URL")
+INFERENCE_TIMEOUT = (5, 60)
+# seconds the server's /health is reused for, so a restart with new weights changes
+# the cache keys the app uses within this long
+SERVER_INFO_TTL = float(os.environ.get("HOTSEATS_INFERENCE_INFO_TTL", "30"))
+
+# one connection pool per process, shared by every session
+_session = requests.Session()
+# url -> (time fetched, /health JSON)
+_server_info = {}
+_server_info_lock = threading.Lock()
+
+
+class RemoteModel:
+    """Run predict() on the inference server's encode or decode endpoint."""
+
+    def __init__(self, url, endpoint):
+        self.url = f"{url.rstrip('/')}/{endpoint}"
+
+    def predict(self, batch, **kwargs):
+        buffer = io.BytesIO()
+        np.save(buffer, np.asarray(batch, dtype=np.float32), allow_pickle=False)
+        response = _session.post(
+            self.url,
+            data=buffer.getvalue(),
+            headers={"Content-Type": "application/octet-stream"},
+            timeout=INFERENCE_TIMEOUT,
+        )
+        response.raise_for_status()
+        return np.load(io.BytesIO(response.content), allow_pickle=False)
+
+
+def remote_models(url=None):
+    """Return an (encoder, decoder) pair served by the inference server."""
+    url = url or INFERENCE_URL
+    return RemoteModel(url, "encode"), RemoteModel(url, "decode")
+
+
+def server_info(url=None):
+    """
+    Return the server's /health JSON, fetched at most once every SERVER_INFO_TTL
+    seconds.
+    """
+    url = url or INFERENCE_URL
+    with _server_info_lock:
+        cached = _server_info.get(url)
+    if cached is not None and time.monotonic() - cached[0] < SERVER_INFO_TTL:
+        return cached[1]
+    response = _session.get(f"{url.rstrip('/')}/health", timeout=INFERENCE_TIMEOUT)
+    response.raise_for_status()
+    info = response.json()
+    with _server_info_lock:
+        _server_info[url] = (time.monotonic(), info)
+    return info
+
+
+def weights_version(url=None):
+    return server_info(url)["weights_version"]
+
+
+def decoder_weights_version(url=None):
+    return server_info(url)["decoder_weights_version"]
@@ -0,0 +1,352 @@
+"""
+A local inference server that owns the encoder and decoder, and batches requests.
+
+Without it every Streamlit session runs its own predict calls with a handful of rows,
+so concurrent users never share a forward pass. The server runs one encoder and one
+decoder, each behind a DynamicBatcher: requests arriving within
+HOTSEATS_INFERENCE_BATCH_WINDOW milliseconds of each other are concatenated into one
+predict call of at most HOTSEATS_INFERENCE_MAX_BATCH rows. When more than
+HOTSEATS_INFERENCE_QUEUE_DEPTH requests are waiting, new ones get a 503 rather than
+queueing without bound.
+
+Endpoints (arrays are sent and returned as .npy bytes):
+    POST /encode        (n, 100, 100, 3) float32 images -> (n, 100) z_mean
+    POST /decode        (n, 100) latent vectors -> (n, 100, 100, 3) images
+    POST /interpolate   (2, 100) endpoints, ?steps=10&method=linear&endpoint=0
+                        -> (steps, 100, 100, 3) images
+    GET  /health        JSON with the weights version and batching stats
+    GET  /metrics       stage timings in the Prometheus text format, see
+                        instrumentation.py
+
+Run from the hotseats_www directory:
+    python inference_server.py --port 8502
+and start the app with HOTSEATS_INFERENCE_URL=http://127.0.0.1:8502 to use it, see
+inference_client.py.
+"""
+
+import argparse
+import io
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+import autoencoder, instrumentation
+
+
+INFERENCE_MAX_BATCH = int(os.environ.get("HOTSEATS_INFERENCE_MAX_BATCH", "64"))
+INFERENCE_BATCH_WINDOW = float(os.environ.get("HOTSEATS_INFERENCE_BATCH_WINDOW", "5"))
+INFERENCE_QUEUE_DEPTH = int(os.environ.get("HOTSEATS_INFERENCE_QUEUE_DEPTH", "256"))
+# seconds a request waits for its batch before the server gives up on it
+INFERENCE_TIMEOUT = 60
+# the shapes autoencoder.encoder_model and decoder_model are built with
+IMAGE_SHAPE = (100, 100, 3)
+ENCODING_DIM = 100
+
+
+class QueueFull(RuntimeError):
+    """Too many requests are already waiting for the model."""
+
+
+class DynamicBatcher:
+    """
+    Merge concurrent predict requests into batches, run on one worker thread.
+
+    The worker takes the first waiting request, then keeps collecting requests until
+    the batch window has passed since it arrived or max_batch_size rows are
+    gathered, and runs them through predict in one call. A request is never split
+    across batches, so one larger than max_batch_size runs on its own.
+
+    Requests are checked against row_shape when they are submitted, so a malformed
+    one is rejected on its own rather than failing the batch it would have joined.
+    """
+
+    def __init__(
+        self,
+        predict,
+        row_shape,
+        max_batch_size=INFERENCE_MAX_BATCH,
+        window_ms=INFERENCE_BATCH_WINDOW,
+        max_queue=INFERENCE_QUEUE_DEPTH,
+        name="batcher",
+    ):
+        self.predict = predict
+        self.row_shape = tuple(row_shape)
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        # a request that didn't fit in the previous batch, to start the next one
+        self._carried = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.rows = 0
+        self.rejected = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        """
+        Queue an (n, *row_shape) array and return a Future of its (n, ...) outputs.
+        Raises ValueError if the array doesn't have that shape, or isn't numeric.
+        """
+        rows = np.asarray(rows)
+        if rows.ndim != len(self.row_shape) + 1 or rows.shape[1:] != self.row_shape:
+            raise ValueError(
+                f"Expected an array of shape (n, {', '.join(map(str, self.row_shape))}), "
+                f"got {rows.shape}"
+            )
+        if len(rows) == 0:
+            raise ValueError("Expected at least one row")
+        if not (
+            np.issubdtype(rows.dtype, np.floating) or np.issubdtype(rows.dtype, np.integer)
+        ):
+            raise ValueError(f"Expected a numeric array, got dtype {rows.dtype}")
+        future = Future()
+        try:
+            self._queue.put_nowait((rows.astype(np.float32, copy=False), future))
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            raise QueueFull(f"{self._queue.maxsize} requests already waiting")
+        return future
+
+    def _collect(self):
+        first = self._carried or self._queue.get()
+        self._carried = None
+        requests = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.window
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                self._carried = request
+                break
+            requests.append(request)
+            size += len(request[0])
+        return requests
+
+    def _run(self):
+        while True:
+            requests = self._collect()
+            requests = [
+                (rows, future)
+                for rows, future in requests
+                if future.set_running_or_notify_cancel()
+            ]
+            if not requests:
+                continue
+            try:
+                outputs = self.predict(np.concatenate([rows for rows, _ in requests]))
+            except Exception as e:
+                for _, future in requests:
+                    future.set_exception(e)
+                continue
+            start = 0
+            for rows, future in requests:
+                future.set_result(outputs[start : start + len(rows)])
+                start += len(rows)
+            with self._lock:
+                self.batches += 1
+                self.rows += start
+
+    def stats(self):
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "rows": self.rows,
+                "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+                "rejected": self.rejected,
+                "queued": self._queue.qsize(),
+            }
+
+
+def load_array(data):
+    """Return the array in a .npy body, raising ValueError if it isn't one."""
+    if not data:
+        raise ValueError("Expected a .npy array in the request body, got no body")
+    try:
+        array = np.load(io.BytesIO(data), allow_pickle=False)
+    except (EOFError, OSError, ValueError) as e:
+        raise ValueError(f"Expected a .npy array in the request body: {e}") from e
+    if not isinstance(array, np.ndarray):
+        # np.load also opens .npz archives
+        raise ValueError("Expected a .npy array in the request body, got an archive")
+    return array
+
+
+def dump_array(array):
+    buffer = io.BytesIO()
+    np.save(buffer, np.asarray(array, dtype=np.float32), allow_pickle=False)
+    return buffer.getvalue()
+
+
+class InferenceService:
+    """The encoder and decoder batchers, and the operations the server exposes."""
+
+    def __init__(
+        self,
+        encoder,
+        decoder,
+        weights_version,
+        decoder_weights_version=None,
+        image_shape=IMAGE_SHAPE,
+        encoding_dim=ENCODING_DIM,
+        **batcher_options,
+    ):
+        self.weights_version = weights_version
+        self.decoder_weights_version = decoder_weights_version
+        self.encoding_dim = encoding_dim
+        self.encoder = DynamicBatcher(
+            lambda batch: encoder.predict(batch, batch_size=len(batch), verbose=0),
+            image_shape,
+            name="encode-batcher",
+            **batcher_options,
+        )
+        self.decoder = DynamicBatcher(
+            lambda batch: decoder.predict(batch, batch_size=len(batch), verbose=0),
+            (encoding_dim,),
+            name="decode-batcher",
+            **batcher_options,
+        )
+
+    def encode(self, images):
+        return self.encoder.submit(images).result(timeout=INFERENCE_TIMEOUT)
+
+    def decode(self, latent_vectors):
+        return self.decoder.submit(latent_vectors).result(timeout=INFERENCE_TIMEOUT)
+
+    def interpolate(self, endpoints, steps=10, method="linear", endpoint=False):
+        endpoints = np.asarray(endpoints)
+        if endpoints.shape != (2, self.encoding_dim):
+            raise ValueError(
+                f"Expected endpoints of shape (2, {self.encoding_dim}), "
+                f"got {endpoints.shape}"
+            )
+        latent_vectors = autoencoder.interpolate_latent_vectors(
+            endpoints[0], endpoints[1], steps=steps, method=method, endpoint=endpoint
+        )
+        return self.decode(latent_vectors)
+
+    def health(self):
+        return {
+            "weights_version": self.weights_version,
+            "decoder_weights_version": self.decoder_weights_version,
+            "model_runtime": autoencoder.MODEL_RUNTIME,
+            "tensorflow_version": autoencoder.tensorflow_version(),
+            "encode": self.encoder.stats(),
+            "decode": self.decoder.stats(),
+        }
+
+
+def make_handler(service):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_error(self, status, message):
+            self._send(status, json.dumps({"error": message}).encode(), "application/json")
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/health":
+                self._send(200, json.dumps(service.health()).encode(), "application/json")
+            elif path == "/metrics":
+                self._send(
+                    200,
+                    instrumentation.prometheus_text().encode(),
+                    "text/plain; version=0.0.4",
+                )
+            else:
+                self._send_error(404, f"No such endpoint {self.path}")
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                if length <= 0:
+                    raise ValueError("Expected a Content-Length header and a body")
+                array = load_array(self.rfile.read(length))
+                if url.path == "/encode":
+                    result = service.encode(array)
+                elif url.path == "/decode":
+                    result = service.decode(array)
+                elif url.path == "/interpolate":
+                    result = service.interpolate(
+                        array,
+                        steps=int(query.get("steps", 10)),
+                        method=query.get("method", "linear"),
+                        endpoint=query.get("endpoint", "0") not in ("0", "false"),
+                    )
+                else:
+                    self._send_error(404, f"No such endpoint {url.path}")
+                    return
+            except QueueFull as e:
+                self._send_error(503, str(e))
+                return
+            except ValueError as e:
+                self._send_error(400, str(e))
+                return
+            except Exception as e:
+                # e.g. a TensorFlow error from predict, or a timed-out batch
+                self._send_error(500, f"{type(e).__name__}: {e}")
+                return
+            self._send(200, dump_array(result), "application/octet-stream")
+
+        def log_message(self, format, *args):
+            # the default logs every request to stderr, which is too noisy under load
+            pass
+
+    return InferenceHandler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--max-batch-size", type=int, default=INFERENCE_MAX_BATCH)
+    parser.add_argument(
+        "--batch-window",
+        type=float,
+        default=INFERENCE_BATCH_WINDOW,
+        help="milliseconds to wait for more requests to batch with the first",
+    )
+    parser.add_argument("--queue-depth", type=int, default=INFERENCE_QUEUE_DEPTH)
+    args = parser.parse_args()
+
+    encoder, decoder = autoencoder.serving_models()
+    service = InferenceService(
+        encoder,
+        decoder,
+        autoencoder.weights_version(),
+        autoencoder.decoder_weights_version(),
+        max_batch_size=args.max_batch_size,
+        window_ms=args.batch_window,
+        max_queue=args.queue_depth,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Serving the {autoencoder.MODEL_RUNTIME} models on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+"""
+Per-stage timing and memory instrumentation for the app's request path.
+
+Stages are wrapped in span("name") blocks or decorated with @timed("name"). Each span
+records its wall time and the CPU time of the thread running it. Spans inside a
+trace() block, which the app opens around each rerun, are collected into that
+trace. Spans on other threads, like the model pool warm-up, only count towards the
+process-wide totals.
+
+Each trace also records the resident set size at its start and end, and the largest
+RSS sampled at its span boundaries, as the rerun's peak. ru_maxrss can't be used for
+this: it is the peak over the life of the process, so once the models are loaded it
+is the same for every rerun. It is reported separately as the process peak. RSS is
+read from /proc, so the per-rerun figures are None on other platforms.
+
+Set HOTSEATS_INSTRUMENTATION=1 to enable it. Each finished trace is then logged as
+one JSON line to the "hotseats.instrumentation" logger, and prometheus_text()
+renders the totals in the Prometheus text format. HOTSEATS_DEBUG_SIDEBAR=1 also
+shows the last trace in the app's sidebar.
+
+When disabled, span() returns a shared no-op context manager and @timed returns the
+function unchanged, so the instrumented code pays for one function call at most.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+INSTRUMENTATION_ENABLED = os.environ.get("HOTSEATS_INSTRUMENTATION", "0") not in ("", "0")
+DEBUG_SIDEBAR = os.environ.get("HOTSEATS_DEBUG_SIDEBAR", "0") not in ("", "0")
+
+logger = logging.getLogger("hotseats.instrumentation")
+if INSTRUMENTATION_ENABLED and not logger.handlers:
+    # the app doesn't configure logging, so the traces would be dropped otherwise
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def current_rss_bytes():
+    """Return the current resident set size of this process, or None if unknown."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * _PAGE_SIZE
+
+
+def process_peak_rss_bytes():
+    """Return the peak resident set size over the life of this process, or None."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    """The spans recorded during one rerun, with its totals."""
+
+    def __init__(self, name):
+        self.name = name
+        self.spans = []
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.rss_start_bytes = None
+        self.rss_end_bytes = None
+        self.rss_peak_bytes = None
+        self.process_peak_rss_bytes = None
+
+    def sample_rss(self):
+        rss = current_rss_bytes()
+        if rss is not None and (self.rss_peak_bytes is None or rss > self.rss_peak_bytes):
+            self.rss_peak_bytes = rss
+        return rss
+
+    @property
+    def rss_delta_bytes(self):
+        if self.rss_start_bytes is None or self.rss_end_bytes is None:
+            return None
+        return self.rss_end_bytes - self.rss_start_bytes
+
+    def to_dict(self):
+        return {
+            "trace": self.name,
+            "wall_seconds": self.wall_seconds,
+            "cpu_seconds": self.cpu_seconds,
+            "rss_start_bytes": self.rss_start_bytes,
+            "rss_end_bytes": self.rss_end_bytes,
+            "rss_delta_bytes": self.rss_delta_bytes,
+            "rss_peak_bytes": self.rss_peak_bytes,
+            "process_peak_rss_bytes": self.process_peak_rss_bytes,
+            "spans": self.spans,
+        }
+
+
+_local = threading.local()
+_totals = {}
+_totals_lock = threading.Lock()
+
+
+def _record(name, wall_seconds, cpu_seconds, error):
+    with _totals_lock:
+        totals = _totals.setdefault(
+            name, {"calls": 0, "errors": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0}
+        )
+        totals["calls"] += 1
+        totals["errors"] += error
+        totals["wall_seconds"] += wall_seconds
+        totals["cpu_seconds"] += cpu_seconds
+    trace = getattr(_local, "trace", None)
+    if trace is not None:
+        trace.sample_rss()
+        trace.spans.append(
+            {
+                "name": name,
+                "wall_seconds": wall_seconds,
+                "cpu_seconds": cpu_seconds,
+                "error": error,
+            }
+        )
+
+
+class _Span:
+    __slots__ = ("name", "_wall", "_cpu")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._wall = time.perf_counter()
+        self._cpu = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _record(
+            self.name,
+            time.perf_counter() - self._wall,
+            time.thread_time() - self._cpu,
+            exc_type is not None,
+        )
+        return False
+
+
+def span(name):
+    """Time the with-block as the named stage."""
+    if not INSTRUMENTATION_ENABLED:
+        return _NOOP_SPAN
+    return _Span(name)
+
+
+def timed(name=None):
+    """Decorator timing every call of the function as a stage, by default its name."""
+
+    def decorator(function):
+        if not INSTRUMENTATION_ENABLED:
+            return function
+        stage = name or function.__qualname__
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Span(stage):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def trace(name):
+    """
+    Collect the spans run on this thread in the with-block, e.g. one rerun, and log
+    them when it ends. Yields the Trace, or None when disabled.
+    """
+    if not INSTRUMENTATION_ENABLED:
+        yield None
+        return
+    current = Trace(name)
+    previous = getattr(_local, "trace", None)
+    _local.trace = current
+    current.rss_start_bytes = current.sample_rss()
+    wall = time.perf_counter()
+    cpu = time.thread_time()
+    try:
+        yield current
+    finally:
+        _local.trace = previous
+        current.wall_seconds = time.perf_counter() - wall
+        current.cpu_seconds = time.thread_time() - cpu
+        current.rss_end_bytes = current.sample_rss()
+        current.process_peak_rss_bytes = process_peak_rss_bytes()
+        logger.info(json.dumps(current.to_dict()))
+
+
+def totals():
+    """Return a copy of the process-wide per-stage totals."""
+    with _totals_lock:
+        return {name: dict(values) for name, values in _totals.items()}
+
+
+def prometheus_text():
+    """Render the per-stage totals and RSS in the Prometheus text format."""
+    lines = [
+        "# HELP hotseats_stage_calls_total Number of times each stage ran.",
+        "# TYPE hotseats_stage_calls_total counter",
+    ]
+    stage_totals = totals()
+    for name, values in sorted(stage_totals.items()):
+        lines.append(f'hotseats_stage_calls_total{{stage="{name}"}} {values["calls"]}')
+    lines += [
+        "# HELP hotseats_stage_errors_total Number of times each stage raised.",
+        "# TYPE hotseats_stage_errors_total counter",
+    ]
+    for name, values in sorted(stage_totals.items()):
+        lines.append(f'hotseats_stage_errors_total{{stage="{name}"}} {values["errors"]}')
+    lines += [
+        "# HELP hotseats_stage_seconds_total Time spent in each stage.",
+        "# TYPE hotseats_stage_seconds_total counter",
+    ]
+    for name, values in sorted(stage_totals.items()):
+        for clock in ("wall", "cpu"):
+            lines.append(
+                f'hotseats_stage_seconds_total{{stage="{name}",clock="{clock}"}} '
+                f'{values[f"{clock}_seconds"]:.6f}'
+            )
+    rss = current_rss_bytes()
+    if rss is not None:
+        lines += [
+            "# HELP hotseats_rss_bytes Current resident set size of the process.",
+            "# TYPE hotseats_rss_bytes gauge",
+            f"hotseats_rss_bytes {rss}",
+        ]
+    peak = process_peak_rss_bytes()
+    if peak is not None:
+        lines += [
+            "# HELP hotseats_peak_rss_bytes Peak resident set size of the process.",
+            "# TYPE hotseats_peak_rss_bytes gauge",
+            f"hotseats_peak_rss_bytes {peak}",
+        ]
+    return "\n".join(lines) + "\n"
+
+
+def render_debug_sidebar(last_trace):
+    """Show a trace's spans, and the process totals, in the Streamlit sidebar."""
+    if not DEBUG_SIDEBAR or last_trace is None:
+        return
+    import streamlit as st
+
+    with st.sidebar:
+        st.subheader("Timings")
+        st.caption(
+            f"Rerun: {last_trace.wall_seconds * 1000:.0f} ms wall, "
+            f"{last_trace.cpu_seconds * 1000:.0f} ms CPU"
+        )
+        if last_trace.rss_peak_bytes is not None:
+            st.caption(
+                f"RSS this rerun: peak {last_trace.rss_peak_bytes / 2**20:.0f} MiB, "
+                f"change {last_trace.rss_delta_bytes / 2**20:+.1f} MiB"
+            )
+        if last_trace.process_peak_rss_bytes is not None:
+            st.caption(
+                f"Process peak RSS: {last_trace.process_peak_rss_bytes / 2**20:.0f} MiB"
+            )
+        st.table(
+            [
+                {
+                    "stage": s["name"],
+                    "wall ms": round(s["wall_seconds"] * 1000, 1),
+                    "cpu ms": round(s["cpu_seconds"] * 1000, 1),
+                }
+                for s in last_trace.spans
+            ]
+        )
+        with st.expander("Process totals"):
+            st.code(prometheus_text(), language="text")
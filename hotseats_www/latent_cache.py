@@ -0,0 +1,251 @@
+"""
+A content-addressed cache of encoder outputs for uploaded images.
+
+Streamlit reruns the whole script on every widget change, and the same chair photos
+are often uploaded again, so we key the encoder outputs by a hash of the uploaded bytes
+and the model weights. A hit skips encoder.predict, and the image decoding unless the
+caller has already decoded the image.
+
+The in-memory tier is a bounded LRU, sized with HOTSEATS_LATENT_CACHE_SIZE. Set
+HOTSEATS_LATENT_CACHE_DIR to also keep the entries on disk, so they survive restarts.
+The directory keeps at most HOTSEATS_LATENT_CACHE_DISK_SIZE entries, the least
+recently used are deleted first.
+"""
+
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+
+import numpy as np
+
+import instrumentation, uploaded_images
+
+
+LATENT_CACHE_SIZE = int(os.environ.get("HOTSEATS_LATENT_CACHE_SIZE", "256"))
+LATENT_CACHE_DIR = os.environ.get("HOTSEATS_LATENT_CACHE_DIR")
+LATENT_CACHE_DISK_SIZE = int(os.environ.get("HOTSEATS_LATENT_CACHE_DISK_SIZE", "10000"))
+
+
+class LRUCache:
+    """
+    A thread-safe, size-bounded least-recently-used cache with hit/miss counters.
+    """
+
+    def __init__(self, max_entries):
+        if max_entries < 1:
+            raise ValueError(f"Cache size must be at least 1, got {max_entries}")
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Return the cached value, or None on a miss."""
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+def remove_quietly(path):
+    """Delete a file, ignoring it if it has already gone."""
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def prune_directory(directory, suffix, max_entries):
+    """
+    Delete the oldest files ending in suffix, by modification time, until at most
+    max_entries are left. Returns the number of files deleted.
+    """
+    files = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.name.endswith(suffix):
+                continue
+            try:
+                files.append((entry.stat().st_mtime_ns, entry.path))
+            except OSError:
+                # deleted by another process since the scan
+                continue
+    if len(files) <= max_entries:
+        return 0
+    files.sort()
+    for _, path in files[: len(files) - max_entries]:
+        remove_quietly(path)
+    return len(files) - max_entries
+
+
+def touch(path):
+    """Mark a disk entry as recently used, so pruning keeps it."""
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+
+
+def cache_key(image_bytes, weights_version):
+    """Hash the uploaded bytes together with the weights they were encoded by."""
+    digest = hashlib.sha256()
+    digest.update(weights_version.encode())
+    digest.update(b"\0")
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+class LatentCache:
+    """
+    Encoder outputs keyed by cache_key, in memory and optionally on disk.
+
+    Entries are dicts of (1, encoding_dim) arrays, with a "z_mean" key and, for
+    encodings from the full VAE encoder, a "z_log_var" key. On disk, each entry is
+    one .npz file, and a file that can't be read is deleted and treated as a miss.
+    """
+
+    def __init__(
+        self,
+        max_entries=LATENT_CACHE_SIZE,
+        directory=LATENT_CACHE_DIR,
+        max_disk_entries=LATENT_CACHE_DISK_SIZE,
+    ):
+        self.memory = LRUCache(max_entries)
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.disk_hits = 0
+        self.disk_evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.npz")
+
+    def get(self, key):
+        entry = self.memory.get(key)
+        if entry is not None or not self.directory:
+            return entry
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                entry = {name: data[name] for name in data.files}
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, zipfile.BadZipFile):
+            # a truncated or corrupt entry, encode the image again
+            remove_quietly(path)
+            return None
+        touch(path)
+        self.disk_hits += 1
+        self.memory.put(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        self.memory.put(key, entry)
+        if not self.directory:
+            return
+        # write to a temp file and rename, so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".npz.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **entry)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            remove_quietly(tmp_path)
+            return
+        self.disk_evictions += prune_directory(
+            self.directory, ".npz", self.max_disk_entries
+        )
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        stats["disk_evictions"] = self.disk_evictions
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide latent cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = LatentCache()
+        return _cache
+
+
+def encode_images(encoder, images, weights_version, cache=None, decoded=None):
+    """
+    Return a cache entry for each uploaded image, see LatentCache.
+
+    Images that miss the cache are encoded together in one batch. decoded can give
+    the images already preprocessed by uploaded_images.load_image, in the same
+    order, otherwise the misses are preprocessed here.
+    The encoder can be the inference encoder, which outputs only z_mean, or the full
+    VAE encoder, which outputs (z_mean, z_log_var, z).
+    """
+    cache = cache or get_cache()
+    keys = []
+    entries = []
+    for image_data in images:
+        image_bytes = uploaded_images.read_image_bytes(image_data)
+        key = cache_key(image_bytes, weights_version)
+        keys.append((key, image_bytes))
+        entries.append(cache.get(key))
+
+    misses = [i for i, entry in enumerate(entries) if entry is None]
+    if misses:
+        batch = np.array(
+            [
+                decoded[i]
+                if decoded is not None
+                else uploaded_images.preprocess_image(io.BytesIO(keys[i][1]))
+                for i in misses
+            ]
+        )
+        with instrumentation.span("encoder.predict"):
+            outputs = encoder.predict(batch)
+        if isinstance(outputs, (list, tuple)):
+            outputs = {"z_mean": outputs[0], "z_log_var": outputs[1]}
+        else:
+            outputs = {"z_mean": outputs}
+        for row, i in enumerate(misses):
+            entry = {name: value[row : row + 1] for name, value in outputs.items()}
+            cache.put(keys[i][0], entry)
+            entries[i] = entry
+    return entries
@@ -0,0 +1,281 @@
+"""
+A nearest-neighbour index over the encoded chair dataset, to find the real chairs
+closest to a generated one, with no network call.
+
+The offline job below encodes every image in the processed dataset once, in large
+batches, and stores the z_mean vectors as one (n, 100) float16 (or float32) matrix,
+with the image paths alongside. Queries are exact Euclidean top-k searches over the
+matrix. The matrix is upcast to float32 in memory when the index is loaded, since
+NumPy's float16 arithmetic is several times slower.
+
+With --ivf-lists the vectors are also clustered with k-means into an inverted file:
+the rows are stored grouped by their nearest centroid, and a query only scans the
+lists of the nprobe centroids closest to it. This is approximate, but scans a
+fraction of the matrix.
+
+Run from the hotseats_www directory, e.g.:
+    python latent_index.py ../raw_data/processed_data/seeing_3d_chairs_cropped_256x256
+    python latent_index.py ../raw_data/processed_data/seeing_3d_chairs_cropped_256x256 --ivf-lists 512
+
+The app shows the closest chairs when the index exists in HOTSEATS_LATENT_INDEX_DIR,
+or a "latent_index" directory next to the downloaded model weights.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+import autoencoder
+
+
+LATENT_INDEX_DIR = os.environ.get("HOTSEATS_LATENT_INDEX_DIR")
+VECTORS_FILENAME = "vectors.npy"
+CENTROIDS_FILENAME = "centroids.npy"
+LIST_OFFSETS_FILENAME = "list_offsets.npy"
+METADATA_FILENAME = "metadata.json"
+ASSIGN_BLOCK_SIZE = 65536
+
+
+def default_index_dir():
+    return LATENT_INDEX_DIR or os.path.join(autoencoder.tmp_dir(), "latent_index")
+
+
+def squared_norms(vectors):
+    return np.einsum("ij,ij->i", vectors, vectors)
+
+
+def squared_distances(vectors, query, norms=None):
+    """
+    Squared Euclidean distances from query to every row of a float32 matrix, as
+    |x|^2 - 2 x.q + |q|^2, so the search is one matrix-vector product.
+    """
+    query = np.asarray(query, dtype=np.float32)
+    if norms is None:
+        norms = squared_norms(vectors)
+    distances = norms - 2.0 * (vectors @ query)
+    distances += query @ query
+    # rounding can take distances to near-identical vectors slightly negative
+    return np.maximum(distances, 0.0, out=distances)
+
+
+def top_k(distances, k):
+    """Return the indices of the k smallest distances, nearest first."""
+    k = min(k, len(distances))
+    if k == 0:
+        return np.empty(0, dtype=np.int64)
+    nearest = np.argpartition(distances, k - 1)[:k]
+    return nearest[np.argsort(distances[nearest])]
+
+
+def kmeans(vectors, n_clusters, iterations=20, sample_size=100_000, seed=0):
+    """
+    Return (n_clusters, dim) centroids, fitted with Lloyd's algorithm on a sample.
+    There are never more centroids than sampled vectors.
+    """
+    rng = np.random.default_rng(seed)
+    sample = np.asarray(
+        vectors[rng.choice(len(vectors), min(sample_size, len(vectors)), replace=False)],
+        dtype=np.float32,
+    )
+    n_clusters = min(n_clusters, len(sample))
+    centroids = sample[rng.choice(len(sample), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = assign(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        filled = counts > 0
+        # empty clusters keep their previous centroid
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+def assign(vectors, centroids, block_size=ASSIGN_BLOCK_SIZE):
+    """Return the index of the nearest centroid for every row."""
+    centroid_norms = squared_norms(centroids)
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start : start + block_size], dtype=np.float32)
+        # |x - c|^2 without the |x|^2 term, which doesn't change the argmin
+        scores = centroid_norms - 2.0 * block @ centroids.T
+        assignments[start : start + len(block)] = scores.argmin(axis=1)
+    return assignments
+
+
+class LatentIndex:
+    """
+    Exact or IVF top-k search over stored latent vectors.
+    """
+
+    def __init__(self, vectors, paths, centroids=None, list_offsets=None, metadata=None):
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.norms = squared_norms(self.vectors)
+        self.paths = paths
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.metadata = metadata or {}
+
+    def __len__(self):
+        return len(self.paths)
+
+    @classmethod
+    def load(cls, directory):
+        with open(os.path.join(directory, METADATA_FILENAME)) as f:
+            metadata = json.load(f)
+        vectors = np.load(os.path.join(directory, VECTORS_FILENAME))
+        centroids = list_offsets = None
+        if os.path.exists(os.path.join(directory, CENTROIDS_FILENAME)):
+            centroids = np.load(os.path.join(directory, CENTROIDS_FILENAME))
+            list_offsets = np.load(os.path.join(directory, LIST_OFFSETS_FILENAME))
+        return cls(vectors, metadata.pop("paths"), centroids, list_offsets, metadata)
+
+    def search(self, query, k=5, nprobe=8):
+        """
+        Return [(path, distance)] for the k stored vectors nearest the query.
+
+        With an IVF index, only the nprobe lists nearest the query are scanned;
+        pass nprobe=None for an exact search.
+        """
+        query = np.asarray(query, dtype=np.float32).reshape(-1)
+        if self.centroids is None or nprobe is None:
+            rows = None
+            distances = squared_distances(self.vectors, query, self.norms)
+        else:
+            probed = top_k(squared_distances(self.centroids, query), nprobe)
+            # each list is a contiguous slice of the matrix
+            rows = np.concatenate(
+                [
+                    np.arange(self.list_offsets[i], self.list_offsets[i + 1])
+                    for i in probed
+                ]
+            )
+            distances = squared_distances(self.vectors[rows], query, self.norms[rows])
+        nearest = top_k(distances, k)
+        if rows is not None:
+            nearest_rows = rows[nearest]
+        else:
+            nearest_rows = nearest
+        return [
+            (self.paths[row], float(np.sqrt(distance)))
+            for row, distance in zip(nearest_rows, distances[nearest])
+        ]
+
+
+def save_index(
+    directory, vectors, paths, dtype=np.float16, ivf_lists=None, metadata=None
+):
+    """
+    Write the vectors and paths as an index directory, optionally with IVF lists.
+    """
+    os.makedirs(directory, exist_ok=True)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    metadata = dict(metadata or {}, dtype=np.dtype(dtype).name)
+    if ivf_lists:
+        centroids = kmeans(vectors, ivf_lists)
+        assignments = assign(vectors, centroids)
+        # store the rows grouped by list, so each list is a contiguous slice
+        order = np.argsort(assignments, kind="stable")
+        vectors = vectors[order]
+        paths = [paths[i] for i in order]
+        counts = np.bincount(assignments, minlength=len(centroids))
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        np.save(os.path.join(directory, CENTROIDS_FILENAME), centroids)
+        np.save(os.path.join(directory, LIST_OFFSETS_FILENAME), list_offsets)
+    else:
+        for filename in (CENTROIDS_FILENAME, LIST_OFFSETS_FILENAME):
+            if os.path.exists(os.path.join(directory, filename)):
+                os.remove(os.path.join(directory, filename))
+    np.save(os.path.join(directory, VECTORS_FILENAME), vectors.astype(dtype))
+    metadata["paths"] = list(paths)
+    with open(os.path.join(directory, METADATA_FILENAME), "w") as f:
+        json.dump(metadata, f)
+
+
+_index = None
+_index_lock = threading.Lock()
+# weights versions already warned about, so a stale index warns once, not every rerun
+_stale_warnings = set()
+
+
+def get_index(weights_version):
+    """
+    Return the app's latent index, or None if it hasn't been built, or was built with
+    encoder weights other than weights_version.
+    """
+    global _index
+    with _index_lock:
+        if _index is None:
+            directory = default_index_dir()
+            if not os.path.exists(os.path.join(directory, METADATA_FILENAME)):
+                return None
+            _index = LatentIndex.load(directory)
+        index_version = _index.metadata.get("weights_version")
+        if index_version != weights_version:
+            if weights_version not in _stale_warnings:
+                _stale_warnings.add(weights_version)
+                print(
+                    f"Skipping the latent index in {default_index_dir()}, it was built "
+                    f"with weights {index_version}, not {weights_version}. Rebuild it "
+                    "with latent_index.py."
+                )
+            return None
+        return _index
+
+
+def main():
+    import batch_interpolate
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("directory", help="directory of processed chair images")
+    parser.add_argument("--output-dir", default=default_index_dir())
+    parser.add_argument("--dtype", choices=("float16", "float32"), default="float16")
+    parser.add_argument(
+        "--ivf-lists", type=int, help="cluster the vectors into this many IVF lists"
+    )
+    parser.add_argument("--batch-size", type=int, default=512)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    if args.ivf_lists is not None and args.ivf_lists < 1:
+        parser.error("--ivf-lists must be at least 1")
+
+    with os.scandir(args.directory) as entries:
+        paths = sorted(
+            entry.path
+            for entry in entries
+            if entry.name.lower().endswith(batch_interpolate.IMAGE_EXTENSIONS)
+        )
+    print(f"Encoding {len(paths)} images from {args.directory}")
+    encoder, _ = autoencoder.serving_models()
+    latents = batch_interpolate.encode_images(
+        encoder, paths, args.batch_size, args.workers
+    )
+    encoded_paths = [path for path in paths if path in latents]
+    if not encoded_paths:
+        print(f"No images could be encoded from {args.directory}", file=sys.stderr)
+        sys.exit(1)
+    vectors = np.stack([latents[path] for path in encoded_paths])
+    if args.ivf_lists and args.ivf_lists > len(vectors):
+        print(f"Only {len(vectors)} vectors, using {len(vectors)} IVF lists")
+
+    start = time.perf_counter()
+    save_index(
+        args.output_dir,
+        vectors,
+        [os.path.abspath(path) for path in encoded_paths],
+        dtype=args.dtype,
+        ivf_lists=args.ivf_lists,
+        metadata={"weights_version": autoencoder.weights_version()},
+    )
+    print(
+        f"Wrote an index of {len(encoded_paths)} vectors to {args.output_dir} "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Serve the encoder and decoder through the TensorFlow Lite interpreter instead of Keras.
+
+The .tflite files are produced by export_tflite.py. The standalone tflite_runtime
+package is used when installed, so the app does not need the full TensorFlow import
+to run inference, otherwise we fall back to the interpreter bundled with TensorFlow.
+"""
+
+import os
+
+import numpy as np
+
+import autoencoder
+
+
+ENCODER_FILENAME = "encoder.tflite"
+DECODER_FILENAME = "decoder.tflite"
+ENCODER_INT8_FILENAME = "encoder_int8.tflite"
+DECODER_INT8_FILENAME = "decoder_int8.tflite"
+
+
+def _interpreter_class():
+    try:
+        from tflite_runtime.interpreter import Interpreter
+    except ImportError:
+        import tensorflow as tf
+
+        Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class LiteModel:
+    """
+    A TFLite model with the same predict(batch) interface as the Keras models.
+
+    Like the Keras models, an instance must only be used by one thread at a time.
+    """
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self._interpreter = _interpreter_class()(model_path=model_path)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = self._input["shape"][0]
+
+    def _resize(self, batch_size):
+        if batch_size == self._batch_size:
+            return
+        shape = list(self._input["shape"])
+        shape[0] = batch_size
+        self._interpreter.resize_tensor_input(self._input["index"], shape)
+        self._interpreter.allocate_tensors()
+        self._input = self._interpreter.get_input_details()[0]
+        self._output = self._interpreter.get_output_details()[0]
+        self._batch_size = batch_size
+
+    def predict(self, batch, **kwargs):
+        """Run the whole batch through the interpreter in one invocation."""
+        batch = np.asarray(batch, dtype=self._input["dtype"])
+        self._resize(len(batch))
+        self._interpreter.set_tensor(self._input["index"], batch)
+        self._interpreter.invoke()
+        # copy, the interpreter reuses its output buffer on the next invoke
+        return np.array(self._interpreter.get_tensor(self._output["index"]))
+
+
+def model_paths(quantized=False):
+    """Return the (encoder, decoder) .tflite paths in the tmp directory."""
+    if quantized:
+        filenames = ENCODER_INT8_FILENAME, DECODER_INT8_FILENAME
+    else:
+        filenames = ENCODER_FILENAME, DECODER_FILENAME
+    return tuple(os.path.join(autoencoder.tmp_dir(), name) for name in filenames)
+
+
+def load_pair(quantized=False):
+    """
+    Load the exported (encoder, decoder) pair.
+    """
+    encoder_path, decoder_path = model_paths(quantized)
+    for path in (encoder_path, decoder_path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(
+                f"{path} not found, run export_tflite.py to create it"
+            )
+    return LiteModel(encoder_path), LiteModel(decoder_path)
@@ -0,0 +1,186 @@
+"""
+A process-wide pool of pre-loaded encoder/decoder pairs.
+
+Building the Keras graphs and loading the weights is most of the cost of a Streamlit
+rerun. The models are not thread-safe, so one instance can't be shared between
+sessions with st.cache_resource. Instead we keep a bounded number of warm pairs, and
+each rerun checks a pair out for its exclusive use and puts it back afterwards.
+
+The pool size and checkout timeout can be set with the HOTSEATS_MODEL_POOL_SIZE and
+HOTSEATS_MODEL_POOL_TIMEOUT environment variables, and HOTSEATS_MODEL_RUNTIME picks
+Keras or the TFLite exports, see autoencoder.serving_models.
+"""
+
+import os
+import queue
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+
+import autoencoder
+
+
+MODEL_POOL_SIZE = int(os.environ.get("HOTSEATS_MODEL_POOL_SIZE", "2"))
+# seconds a rerun waits for a free pair before giving up
+MODEL_POOL_TIMEOUT = float(os.environ.get("HOTSEATS_MODEL_POOL_TIMEOUT", "30"))
+
+
+class ModelPoolExhausted(RuntimeError):
+    """No encoder/decoder pair became free within the checkout timeout."""
+
+
+class ModelPool:
+    """
+    A bounded pool of (encoder, decoder) pairs, handed out one pair per request.
+    """
+
+    def __init__(self, size=MODEL_POOL_SIZE, timeout=MODEL_POOL_TIMEOUT):
+        if size < 1:
+            raise ValueError(f"Model pool size must be at least 1, got {size}")
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.Queue(maxsize=size)
+        self._lock = threading.Lock()
+        self._loaded = 0
+        self._checkouts = 0
+        self._exhausted = 0
+        self._timeouts = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    def warm_up(self):
+        """
+        Build and load every pair in the pool, so no request pays for it.
+        """
+        while True:
+            with self._lock:
+                if self._loaded >= self.size:
+                    return
+                self._loaded += 1
+            try:
+                pair = self._load_pair()
+            except Exception:
+                with self._lock:
+                    self._loaded -= 1
+                raise
+            self._idle.put(pair)
+
+    def _load_pair(self):
+        return autoencoder.serving_models()
+
+    @contextmanager
+    def checkout(self):
+        """
+        Check out an (encoder, decoder) pair for the duration of the with-block.
+        """
+        start = time.perf_counter()
+        try:
+            pair = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                self._exhausted += 1
+            try:
+                pair = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                with self._lock:
+                    self._timeouts += 1
+                raise ModelPoolExhausted(
+                    f"No free model pair after {self.timeout}s (pool size {self.size})"
+                ) from None
+        wait = time.perf_counter() - start
+        with self._lock:
+            self._checkouts += 1
+            self._total_wait += wait
+            self._max_wait = max(self._max_wait, wait)
+
+        try:
+            yield pair
+        finally:
+            self._idle.put(pair)
+
+    def stats(self):
+        """
+        Return a snapshot of the pool metrics.
+
+        "exhausted" counts checkouts that found no idle pair and had to wait.
+        """
+        with self._lock:
+            return {
+                "size": self.size,
+                "loaded": self._loaded,
+                "idle": self._idle.qsize(),
+                "checkouts": self._checkouts,
+                "exhausted": self._exhausted,
+                "timeouts": self._timeouts,
+                "total_wait_seconds": self._total_wait,
+                "max_wait_seconds": self._max_wait,
+                "mean_wait_seconds": (
+                    self._total_wait / self._checkouts if self._checkouts else 0.0
+                ),
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_warm_up_thread = None
+_warm_up_lock = threading.Lock()
+
+
+def get_pool():
+    """
+    Return the process-wide model pool, creating and warming it up on first use.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            pool = ModelPool()
+            pool.warm_up()
+            _pool = pool
+        return _pool
+
+
+class _LazyModel:
+    """Stands in for one model of a lazily checked out pair, see lazy_checkout."""
+
+    def __init__(self, get_pair, index):
+        self._get_pair = get_pair
+        self._index = index
+
+    def predict(self, *args, **kwargs):
+        return self._get_pair()[self._index].predict(*args, **kwargs)
+
+
+@contextmanager
+def lazy_checkout():
+    """
+    Yield an (encoder, decoder) pair that is only checked out of the pool when one
+    of them first runs predict, and is returned at the end of the with-block.
+
+    Reruns answered entirely from the latent and render caches then never wait for
+    the pool to warm up or for a busy pair.
+    """
+    with ExitStack() as stack:
+        pair = []
+
+        def get_pair():
+            if not pair:
+                pair.extend(stack.enter_context(get_pool().checkout()))
+            return pair
+
+        yield _LazyModel(get_pair, 0), _LazyModel(get_pair, 1)
+
+
+def warm_up_in_background():
+    """
+    Start creating the pool on a daemon thread, so TensorFlow and the weights load
+    while the user is still choosing images. get_pool() waits for it to finish.
+    """
+    global _warm_up_thread
+    # don't take _pool_lock here, the warm-up thread holds it while loading
+    with _warm_up_lock:
+        if _warm_up_thread is not None:
+            return
+        _warm_up_thread = threading.Thread(
+            target=get_pool, name="model-pool-warm-up", daemon=True
+        )
+        _warm_up_thread.start()
@@ -1,5 +1,6 @@
 import streamlit as st
-from serpapi import GoogleSearch
+
+import search_cache
 
 def shopping_page():
     st.set_page_config(page_title="Shopping", page_icon=":shopping_bags:")
@@ -50,17 +51,16 @@ def shopping_page():
     }
 
 
-    # Get the filename of the selected interpolation
-    selected_filename = select[selected_interpolation]
-
-    # Perform SerpAPI search for the selected interpolation details using the specific filename
-    params = {
-        "engine": "google_lens",
-        "url": f"https://github.com/alexpapagio/chairs_GAN/blob/master/hotseats_www/{selected_filename}?raw=true",
-        "api_key": st.secrets["SERPAPI_KEY"],  # Use your actual SERPAPI_KEY
+    # Search for all the interpolations in the background, so switching between them
+    # is instant, and results are cached across reruns and restarts
+    search_urls = {
+        option: f"https://github.com/alexpapagio/chairs_GAN/blob/master/hotseats_www/{filename}?raw=true"
+        for option, filename in select.items()
     }
-    search = GoogleSearch(params)
-    results = search.get_dict()
+    prefetcher = search_cache.get_prefetcher(st.secrets["SERPAPI_KEY"])
+    prefetcher.prefetch(search_urls.values())
+    with st.spinner(f"Searching for {selected_interpolation}..."):
+        results = prefetcher.results(search_urls[selected_interpolation])
     if "visual_matches" in results:
         st.header(f"Shopping results for {selected_interpolation}:")
         for match in results["visual_matches"][0:3]:  # Display details for the first 3 matches
@@ -0,0 +1,145 @@
+"""
+A cache of decoded interpolation strips, so repeat views skip decoder.predict.
+
+Changing the selectbox reruns the app, and popular pairs (like the default chairs) are
+viewed by every visitor, so the decoded frames are kept keyed by the two latent
+endpoints, the number of steps, the interpolation method and the decoder weights. The
+endpoints are rounded to QUANTIZATION_STEP first, so encodings that differ only by
+float noise share an entry.
+
+Strips are stored as uint8 frames, in a bounded in-memory LRU sized with
+HOTSEATS_RENDER_CACHE_SIZE. Set HOTSEATS_RENDER_CACHE_DIR to also keep each strip on
+disk as one PNG, with the frames side by side, so they survive restarts. The
+directory keeps at most HOTSEATS_RENDER_CACHE_DISK_SIZE strips, the least recently
+used are deleted first.
+"""
+
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+from PIL import Image
+
+import instrumentation
+from latent_cache import LRUCache, prune_directory, remove_quietly, touch
+
+
+RENDER_CACHE_SIZE = int(os.environ.get("HOTSEATS_RENDER_CACHE_SIZE", "64"))
+RENDER_CACHE_DIR = os.environ.get("HOTSEATS_RENDER_CACHE_DIR")
+RENDER_CACHE_DISK_SIZE = int(os.environ.get("HOTSEATS_RENDER_CACHE_DISK_SIZE", "1000"))
+QUANTIZATION_STEP = 1e-3
+
+
+def render_key(encoding1, encoding2, steps, method, weights_version):
+    """
+    Hash the quantized latent endpoints with everything else the strip depends on.
+    weights_version must identify the decoder weights.
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{weights_version}\0{steps}\0{method}\0".encode())
+    for encoding in (encoding1, encoding2):
+        quantized = np.round(np.asarray(encoding, dtype=np.float64) / QUANTIZATION_STEP)
+        digest.update(quantized.astype(np.int64).tobytes())
+    return digest.hexdigest()
+
+
+def to_uint8(frames):
+    """Convert decoder output in [0, 1] to uint8 frames."""
+    return np.clip(np.asarray(frames) * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+
+class RenderCache:
+    """
+    (steps, height, width, 3) uint8 strips keyed by render_key, in memory and
+    optionally on disk.
+    """
+
+    def __init__(
+        self,
+        max_entries=RENDER_CACHE_SIZE,
+        directory=RENDER_CACHE_DIR,
+        max_disk_entries=RENDER_CACHE_DISK_SIZE,
+    ):
+        self.memory = LRUCache(max_entries)
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.disk_hits = 0
+        self.disk_evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.png")
+
+    def get(self, key, steps):
+        frames = self.memory.get(key)
+        if frames is not None or not self.directory:
+            return frames
+        path = self._path(key)
+        try:
+            with Image.open(path) as img:
+                strip = np.asarray(img.convert("RGB"))
+            height, width = strip.shape[0], strip.shape[1] // steps
+            frames = strip.reshape(height, steps, width, 3).transpose(1, 0, 2, 3).copy()
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            # a truncated or corrupt strip, decode it again
+            remove_quietly(path)
+            return None
+        touch(path)
+        self.disk_hits += 1
+        self.memory.put(key, frames)
+        return frames
+
+    def put(self, key, frames):
+        self.memory.put(key, frames)
+        if not self.directory:
+            return
+        # write to a temp file and rename, so readers never see a partial strip
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".png.tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                Image.fromarray(np.concatenate(list(frames), axis=1)).save(f, format="PNG")
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            remove_quietly(tmp_path)
+            return
+        self.disk_evictions += prune_directory(
+            self.directory, ".png", self.max_disk_entries
+        )
+
+    def stats(self):
+        stats = self.memory.stats()
+        stats["disk_hits"] = self.disk_hits
+        stats["disk_evictions"] = self.disk_evictions
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    """Return the process-wide render cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = RenderCache()
+        return _cache
+
+
+def decode_strip(decoder, latent_vectors, key, cache=None):
+    """
+    Return the uint8 frames for the latent vectors, decoding them in one forward
+    pass on a cache miss.
+    """
+    cache = cache or get_cache()
+    frames = cache.get(key, len(latent_vectors))
+    if frames is None:
+        with instrumentation.span("decoder.predict"):
+            frames = to_uint8(decoder.predict(latent_vectors))
+        cache.put(key, frames)
+    return frames
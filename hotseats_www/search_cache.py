@@ -0,0 +1,184 @@
+"""
+Cached, prefetched visual-search results for the shopping page.
+
+Every Google Lens search through SerpAPI takes seconds and costs API quota, and the
+shopping page searches for the same static interpolation URLs over and over. Results
+are kept in a JSON file keyed by image URL, and expire after
+HOTSEATS_SEARCH_CACHE_TTL seconds (a week by default). Results SerpAPI reports as
+errors, such as "no results", are kept for HOTSEATS_SEARCH_ERROR_TTL seconds (15
+minutes by default), so they aren't searched again on every rerun. The file lives in
+HOTSEATS_SEARCH_CACHE_DIR, or the model download directory.
+
+SearchPrefetcher starts the searches for all the interpolations in the background,
+at most HOTSEATS_SEARCH_RATE requests per second, so switching between them on the
+page doesn't wait on the API. The search function is passed in, so a local stub can
+stand in for SerpAPI.
+"""
+
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import autoencoder
+
+
+SEARCH_CACHE_TTL = float(os.environ.get("HOTSEATS_SEARCH_CACHE_TTL", str(7 * 24 * 3600)))
+SEARCH_ERROR_TTL = float(os.environ.get("HOTSEATS_SEARCH_ERROR_TTL", "900"))
+SEARCH_CACHE_DIR = os.environ.get("HOTSEATS_SEARCH_CACHE_DIR")
+SEARCH_CACHE_FILENAME = "search_cache.json"
+SEARCH_RATE = float(os.environ.get("HOTSEATS_SEARCH_RATE", "2"))
+SEARCH_WORKERS = 4
+
+
+def serpapi_search(api_key):
+    """Return a function searching Google Lens for an image URL through SerpAPI."""
+    from serpapi import GoogleSearch
+
+    def search(url):
+        params = {"engine": "google_lens", "url": url, "api_key": api_key}
+        return GoogleSearch(params).get_dict()
+
+    return search
+
+
+class SearchCache:
+    """
+    Search results by image URL, persisted to a JSON file, with a time-to-live.
+    Entries can be given a shorter time-to-live of their own, e.g. for errors.
+    """
+
+    def __init__(self, path, ttl=SEARCH_CACHE_TTL, clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        try:
+            with open(path) as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def get(self, url):
+        """Return the cached results, or None if missing or expired."""
+        with self._lock:
+            entry = self._entries.get(url)
+        if entry is None or self._expired(entry, self._clock()):
+            return None
+        return entry["results"]
+
+    def _expired(self, entry, now):
+        return now - entry["time"] > entry.get("ttl", self.ttl)
+
+    def put(self, url, results, ttl=None):
+        with self._lock:
+            now = self._clock()
+            entry = {"time": now, "results": results}
+            if ttl is not None:
+                entry["ttl"] = ttl
+            self._entries[url] = entry
+            self._entries = {
+                key: entry
+                for key, entry in self._entries.items()
+                if not self._expired(entry, now)
+            }
+            self._save()
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self._entries, f)
+        os.replace(self.path + ".tmp", self.path)
+
+
+class RateLimiter:
+    """Space out calls to at most rate per second, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+
+class SearchPrefetcher:
+    """
+    Run searches in a background thread pool, through the cache and rate limiter.
+
+    Failed searches are not cached, so they are retried on the next request.
+    Results SerpAPI reports as errors are cached for error_ttl seconds.
+    """
+
+    def __init__(
+        self,
+        search,
+        cache,
+        rate=SEARCH_RATE,
+        workers=SEARCH_WORKERS,
+        error_ttl=SEARCH_ERROR_TTL,
+    ):
+        self.search = search
+        self.cache = cache
+        self.error_ttl = error_ttl
+        self.rate_limiter = RateLimiter(rate)
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="search-prefetch"
+        )
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def _search(self, url):
+        try:
+            self.rate_limiter.wait()
+            results = self.search(url)
+            self.cache.put(
+                url, results, ttl=self.error_ttl if "error" in results else None
+            )
+            return results
+        finally:
+            with self._lock:
+                self._in_flight.pop(url, None)
+
+    def _submit(self, url):
+        with self._lock:
+            future = self._in_flight.get(url)
+            if future is None:
+                future = self._executor.submit(self._search, url)
+                self._in_flight[url] = future
+            return future
+
+    def prefetch(self, urls):
+        """Start searches for the URLs that aren't cached or already in flight."""
+        for url in urls:
+            if self.cache.get(url) is None:
+                self._submit(url)
+
+    def results(self, url, timeout=None):
+        """Return the results for the URL, waiting for the search if needed."""
+        results = self.cache.get(url)
+        if results is not None:
+            return results
+        return self._submit(url).result(timeout=timeout)
+
+
+_prefetcher = None
+_prefetcher_lock = threading.Lock()
+
+
+def get_prefetcher(api_key):
+    """Return the process-wide SerpAPI prefetcher, shared across Streamlit sessions."""
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            directory = SEARCH_CACHE_DIR or autoencoder.tmp_dir()
+            cache = SearchCache(os.path.join(directory, SEARCH_CACHE_FILENAME))
+            _prefetcher = SearchPrefetcher(serpapi_search(api_key), cache)
+        return _prefetcher
@@ -16,50 +16,86 @@ e.g. raw_data/source/seeing_3d_chairs_rendered_chairs/1a2b8749a1756a09932a5c2746
 
 This script is parallelised with Python 3 stdlib, because processing the images takes
 several hours, but has only been tested on Mac OS.
+
+Runs are resumable: a manifest in the output directory records the size and
+modification time of each processed source image, and images that haven't changed
+since are skipped. Pass --force to reprocess everything. Images that fail are
+reported at the end, and retried on the next run.
+
+With --format shards the images are packed into memory-mappable .npy shards
+instead of individual PNGs, see shards.py. Images already in the shards are skipped,
+and --force starts a fresh set.
+
+--sizes writes several resolutions in one pass, e.g. --sizes 256 128 100, each to its
+own directory. Every size is resampled from the same crop, so the 100x100 images
+the served model takes need no further resizing. The output only depends on the
+source images, so re-runs produce identical files and shards.
 """
 
-import os
+import argparse
 import glob
+import json
+import os
+import sys
+import time
+from functools import partial
 from multiprocessing import Pool, cpu_count
 from PIL import Image, ImageOps
 import numpy as np
 
+import shards
 
-def process_image(file_path, output_dir, padding=10):
+
+IMAGE_SIZE = 256
+# a fixed filter, so the output is the same on every run
+RESAMPLE = Image.LANCZOS
+MANIFEST_FILENAME = "manifest.json"
+# save the manifest every this many images, so an interrupted run loses little
+MANIFEST_SAVE_INTERVAL = 1000
+# what a corrupt, truncated or oversized image raises, any other error is a bug and
+# stops the run
+IMAGE_ERRORS = (OSError, ValueError, Image.DecompressionBombError)
+
+
+def output_name_for(file_path):
     # get the image name, it's the second to last directory, above "renders"
     image_name = file_path.split("/")[-3]
-    output_path = os.path.join(
-        output_dir, f"{image_name}-{os.path.basename(file_path)}"
-    )
-    print("processing ", file_path, "output_path", output_path)
+    return f"{image_name}-{os.path.basename(file_path)}"
 
-    # Open the image
-    img = Image.open(file_path).convert("RGB")
 
-    # Get the bounding box
-    # The bounding box is returned as a 4-tuple defining the
-    # left, upper, right, and lower pixel coordinate
+def output_path_for(file_path, output_dir):
+    return os.path.join(output_dir, output_name_for(file_path))
 
-    # This is the original method, but it doesn't work with a white background
-    # bbox = img.getbbox()
 
-    # work from the outside edges in to find the first content pixels
-    # the background is white, assume 255,255,255
+def content_bbox(img):
+    """
+    Return the (left, upper, right, lower) coordinates of the first and last
+    non-white pixels of an RGB image, inclusive.
 
-    # Convert the image to a numpy array
-    img_array = np.array(img)
+    The background is white, assume 255,255,255, so img.getbbox() doesn't work
+    directly. Instead we invert the image, which is the same as its difference
+    from a white image and is zero exactly where the image is white. PIL then finds
+    the bounding box on the uint8 data, without any full-size masks or coordinate
+    arrays.
+    """
+    bbox = ImageOps.invert(img).getbbox()
+    if bbox is None:
+        raise ValueError("image is entirely white")
+    left, upper, right, lower = bbox
+    # getbbox's right and lower edges are exclusive
+    return left, upper, right - 1, lower - 1
 
-    # Get the image size
-    height, width, _ = img_array.shape
 
-    # Find the non-white pixels
-    non_white_pixels = np.where(np.any(img_array != [255, 255, 255], axis=-1))
+def crop_image(file_path, padding=10):
+    """
+    Crop the chair out of the render, with a margin of white padding.
+    """
+    # Open the image
+    img = Image.open(file_path).convert("RGB")
 
-    # Get the bounding box coordinates
-    left = np.min(non_white_pixels[1])
-    upper = np.min(non_white_pixels[0])
-    right = np.max(non_white_pixels[1])
-    lower = np.max(non_white_pixels[0])
+    # Get the bounding box of the chair
+    width, height = img.size
+    left, upper, right, lower = content_bbox(img)
 
     # Add padding to the bounding box
     # but make sure the values don't go below 0 or above the image size
@@ -71,50 +107,304 @@ def process_image(file_path, output_dir, padding=10):
     )
 
     # Crop the image
-    cropped_img = img.crop(bbox)
+    return img.crop(bbox)
 
+
+def fit_to_square(cropped_img, size=IMAGE_SIZE):
+    """
+    Scale the crop to fit a size x size square, preserving aspect ratio, and pad it
+    with white pixels to exactly that size.
+    """
     # Resize the image, preserving aspect ratio.
-    # Scale down to 256x256, do not scale up.
-    cropped_img.thumbnail((256, 256), Image.ANTIALIAS)
-
-    # Pad to 256x256 with new white pixels
-    # Calculate padding
-    width, height = cropped_img.size
-    padding_width = (256 - width) // 2
-    padding_height = (256 - height) // 2
+    # Scale down to size x size, do not scale up.
+    resized_img = cropped_img.copy()
+    resized_img.thumbnail((size, size), RESAMPLE)
+
+    # Pad to size x size with new white pixels
+    # Calculate padding, any odd pixel goes on the right or bottom, so the result
+    # is always exactly size x size
+    width, height = resized_img.size
+    padding_width = (size - width) // 2
+    padding_height = (size - height) // 2
     # Add white padding
-    padded_img = ImageOps.expand(
-        cropped_img,
-        (padding_width, padding_height, padding_width, padding_height),
+    return ImageOps.expand(
+        resized_img,
+        (
+            padding_width,
+            padding_height,
+            size - width - padding_width,
+            size - height - padding_height,
+        ),
         fill=(255, 255, 255),
     )
 
-    # Save the cropped image
-    padded_img.save(output_path)
 
+def crop_to_sizes(file_path, sizes=(IMAGE_SIZE,), padding=10):
+    """
+    Decode and crop the image once, returning a dict of size to the square image.
+    """
+    cropped_img = crop_image(file_path, padding)
+    return {size: fit_to_square(cropped_img, size) for size in sizes}
+
+
+def process_image(file_path, output_dirs, padding=10):
+    """
+    Save the cropped image at each size, output_dirs maps size to directory.
+    """
+    for size, img in crop_to_sizes(file_path, list(output_dirs), padding).items():
+        img.save(output_path_for(file_path, output_dirs[size]))
+
+
+def try_process_image(file_path, output_dirs):
+    """
+    Process one image, returning (file_path, error message or None), so that one bad
+    image doesn't stop the whole run.
+    """
+    try:
+        process_image(file_path, output_dirs)
+    except IMAGE_ERRORS as e:
+        return file_path, f"{type(e).__name__}: {e}"
+    return file_path, None
+
+
+def try_crop_to_arrays(file_path, sizes):
+    """
+    Crop one image to a uint8 array at each size, returning (file_path, dict of size
+    to array or None, error message or None).
+    """
+    try:
+        images = crop_to_sizes(file_path, sizes)
+    except IMAGE_ERRORS as e:
+        return file_path, None, f"{type(e).__name__}: {e}"
+    return file_path, {size: np.asarray(img) for size, img in images.items()}, None
+
+
+def imap_images(function, file_paths, processes=None, chunksize=None, ordered=False):
+    """
+    Yield function(file_path) for each file-path from a single long-lived pool,
+    printing progress as it goes. Results come in completion order, unless ordered.
+    """
+    processes = processes or cpu_count()
+    if chunksize is None:
+        # big enough to amortise the inter-process overhead, small enough that
+        # the workers finish at about the same time
+        chunksize = max(1, min(64, len(file_paths) // (processes * 8)))
+
+    start = time.perf_counter()
+    with Pool(processes) as p:
+        imap = p.imap if ordered else p.imap_unordered
+        results = imap(function, file_paths, chunksize=chunksize)
+        for done, result in enumerate(results, start=1):
+            yield result
+            if done % MANIFEST_SAVE_INTERVAL == 0 or done == len(file_paths):
+                elapsed = time.perf_counter() - start
+                print(
+                    f"Processed {done}/{len(file_paths)} images, "
+                    f"{done / elapsed:.1f} images/s"
+                )
+
+
+def source_signature(file_path):
+    stat = os.stat(file_path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def load_manifest(output_dir):
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest, output_dir):
+    """Write the manifest atomically, so an interrupted save can't corrupt it."""
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+
+
+def is_up_to_date(file_path, output_dir, manifest):
+    return manifest.get(file_path) == source_signature(file_path) and os.path.exists(
+        output_path_for(file_path, output_dir)
+    )
+
+
+def process_images(file_paths, output_dirs, processes=None, chunksize=None):
+    """
+    Process the file-paths on a single long-lived pool, recording each success in
+    the manifests as it completes. output_dirs maps size to directory, and each
+    directory has its own manifest. Returns a dict of failed file-path to error.
+    """
+    manifests = {
+        size: load_manifest(output_dir) for size, output_dir in output_dirs.items()
+    }
+    failures = {}
+    results = imap_images(
+        partial(try_process_image, output_dirs=output_dirs),
+        file_paths,
+        processes=processes,
+        chunksize=chunksize,
+    )
+    for done, (file_path, error) in enumerate(results, start=1):
+        for manifest in manifests.values():
+            if error is None:
+                manifest[file_path] = source_signature(file_path)
+            else:
+                manifest.pop(file_path, None)
+        if error is not None:
+            failures[file_path] = error
+            print(f"Failed to process {file_path}: {error}", file=sys.stderr)
+        if done % MANIFEST_SAVE_INTERVAL == 0 or done == len(file_paths):
+            for size, manifest in manifests.items():
+                save_manifest(manifest, output_dirs[size])
+    return failures
 
-def process_images(file_paths, output_dir):
+
+def write_shards(
+    file_paths,
+    output_dirs,
+    shard_size=shards.DEFAULT_SHARD_SIZE,
+    processes=None,
+    chunksize=None,
+):
     """
-    Process the chunk of file-paths in parallel."""
-    with Pool() as p:
-        p.starmap(process_image, [(file_path, output_dir) for file_path in file_paths])
+    Crop the file-paths on a single long-lived pool, appending each image to the
+    shards of each size as it completes. output_dirs maps size to directory.
+    Returns a dict of failed file-path to error.
+
+    Results are taken in input order, so the shards are the same on every run.
+    """
+    failures = {}
+    writers = {
+        size: shards.ShardWriter(output_dir, (size, size, 3), shard_size=shard_size)
+        for size, output_dir in output_dirs.items()
+    }
+    # a size added since the last run may be missing images the others have
+    existing_names = {size: set(writer.filenames) for size, writer in writers.items()}
+    try:
+        results = imap_images(
+            partial(try_crop_to_arrays, sizes=list(output_dirs)),
+            file_paths,
+            processes=processes,
+            chunksize=chunksize,
+            ordered=True,
+        )
+        for file_path, image_arrays, error in results:
+            if error is None:
+                name = output_name_for(file_path)
+                for size, image_array in image_arrays.items():
+                    if name not in existing_names[size]:
+                        writers[size].append(image_array, name)
+            else:
+                failures[file_path] = error
+                print(f"Failed to process {file_path}: {error}", file=sys.stderr)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return failures
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Crop the Seeing 3D Chairs renders.")
+    parser.add_argument(
+        "--force", action="store_true", help="reprocess images that are up to date"
+    )
+    parser.add_argument(
+        "--format",
+        choices=["png", "shards"],
+        default="png",
+        help="write individual PNGs, or packed .npy shards for training",
+    )
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[IMAGE_SIZE],
+        help="square output resolutions, e.g. 256 128 100",
+    )
+    parser.add_argument(
+        "--shard-size",
+        type=int,
+        default=shards.DEFAULT_SHARD_SIZE,
+        help="images per shard, with --format shards",
+    )
+    parser.add_argument("--processes", type=int, default=cpu_count())
+    parser.add_argument(
+        "--chunksize", type=int, help="images sent to a worker at a time"
+    )
+    args = parser.parse_args()
+
     # Define the source and output directories
     RAW_DATA_DIR = "raw_data/"
     SOURCE_DIR = RAW_DATA_DIR + "source/seeing_3d_chairs_rendered_chairs/"
-    OUTPUT_DIR = RAW_DATA_DIR + "processed_data/seeing_3d_chairs_cropped_256x256/"
-
-    # Ensure the output directory exists
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-    # Get a list of all PNG files in the source directory
-    all_png_paths = glob.glob(SOURCE_DIR + "/**/*.png", recursive=True)
-    # Split the list of file paths into chunks
-    chunks = [
-        all_png_paths[i : i + cpu_count()]
-        for i in range(0, len(all_png_paths), cpu_count())
-    ]
-    for chunk in chunks:
-        process_images(chunk, OUTPUT_DIR)
+    output_kind = "shards" if args.format == "shards" else "cropped"
+    OUTPUT_DIRS = {
+        size: RAW_DATA_DIR
+        + f"processed_data/seeing_3d_chairs_{output_kind}_{size}x{size}/"
+        for size in sorted(set(args.sizes), reverse=True)
+    }
+
+    # Ensure the output directories exist
+    for output_dir in OUTPUT_DIRS.values():
+        os.makedirs(output_dir, exist_ok=True)
+
+    # Get a list of all PNG files in the source directory, sorted so the shards
+    # come out in the same order on every run
+    all_png_paths = sorted(glob.glob(SOURCE_DIR + "/**/*.png", recursive=True))
+
+    # Skip the images already processed by a previous run, at every size
+    if args.format == "shards":
+        done_names = None
+        for output_dir in OUTPUT_DIRS.values():
+            if args.force:
+                for filename in os.listdir(output_dir):
+                    if (
+                        filename.startswith("shard-")
+                        or filename == shards.INDEX_FILENAME
+                    ):
+                        os.remove(os.path.join(output_dir, filename))
+            index = shards.load_index(output_dir)
+            names = set(index["filenames"]) if index else set()
+            done_names = names if done_names is None else done_names & names
+        todo_paths = [
+            file_path
+            for file_path in all_png_paths
+            if output_name_for(file_path) not in done_names
+        ]
+    elif args.force:
+        todo_paths = all_png_paths
+    else:
+        manifests = {
+            output_dir: load_manifest(output_dir) for output_dir in OUTPUT_DIRS.values()
+        }
+        todo_paths = [
+            file_path
+            for file_path in all_png_paths
+            if not all(
+                is_up_to_date(file_path, output_dir, manifest)
+                for output_dir, manifest in manifests.items()
+            )
+        ]
+    print(
+        f"{len(all_png_paths)} images found, "
+        f"{len(all_png_paths) - len(todo_paths)} already up to date"
+    )
+
+    if args.format == "shards":
+        failures = write_shards(
+            todo_paths,
+            OUTPUT_DIRS,
+            shard_size=args.shard_size,
+            processes=args.processes,
+            chunksize=args.chunksize,
+        )
+    else:
+        failures = process_images(
+            todo_paths, OUTPUT_DIRS, processes=args.processes, chunksize=args.chunksize
+        )
+    if failures:
+        print(f"{len(failures)} images failed:")
+        for file_path, error in sorted(failures.items()):
+            print(f"  {file_path}: {error}")
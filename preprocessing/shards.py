@@ -0,0 +1,196 @@
+"""
+Packed training data: fixed-shape uint8 image arrays in .npy shards, with an index.
+
+Instead of tens of thousands of individual PNGs, the crop script can write the
+images into a few large .npy files, which training then memory-maps. Serving a batch
+is a slice of the mapped arrays: there is no per-file open and no PNG decoding.
+
+A shard directory contains shard-00000.npy, shard-00001.npy, ... each of shape
+(count, height, width, 3), and index.json, which records the image shape, the
+number of images in each shard and the source filename of every image, in order.
+
+Example, in the training notebook:
+    from shards import ShardDataset
+    dataset = ShardDataset("raw_data/processed_data/seeing_3d_chairs_shards_256x256")
+    for batch in dataset.batches(64, shuffle=True, seed=0, normalize=True):
+        ...
+"""
+
+import json
+import os
+
+import numpy as np
+
+
+INDEX_FILENAME = "index.json"
+DEFAULT_SHARD_SIZE = 4096
+
+
+def shard_filename(shard_number):
+    return f"shard-{shard_number:05d}.npy"
+
+
+def load_index(directory):
+    try:
+        with open(os.path.join(directory, INDEX_FILENAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class ShardWriter:
+    """
+    Append fixed-shape uint8 images to .npy shards, memory-mapping one shard at a
+    time. Adds to the existing shards in the directory, if there are any.
+    """
+
+    def __init__(self, directory, image_shape, shard_size=DEFAULT_SHARD_SIZE):
+        self.directory = directory
+        self.image_shape = tuple(image_shape)
+        self.shard_size = shard_size
+        os.makedirs(directory, exist_ok=True)
+        self.index = load_index(directory) or {
+            "image_shape": list(self.image_shape),
+            "dtype": "uint8",
+            "shards": [],
+            "filenames": [],
+        }
+        if tuple(self.index["image_shape"]) != self.image_shape:
+            raise ValueError(
+                f"{directory} holds images of shape {self.index['image_shape']}, "
+                f"not {self.image_shape}"
+            )
+        self._shard = None
+        self._count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    @property
+    def filenames(self):
+        return self.index["filenames"]
+
+    def _open_shard(self):
+        path = os.path.join(self.directory, shard_filename(len(self.index["shards"])))
+        self._shard = np.lib.format.open_memmap(
+            path, mode="w+", dtype=np.uint8, shape=(self.shard_size,) + self.image_shape
+        )
+        self._count = 0
+
+    def append(self, image_array, filename):
+        if image_array.shape != self.image_shape:
+            raise ValueError(
+                f"Expected an image of shape {self.image_shape}, got {image_array.shape}"
+            )
+        if self._shard is None:
+            self._open_shard()
+        self._shard[self._count] = image_array
+        self._count += 1
+        self.index["filenames"].append(filename)
+        if self._count == self.shard_size:
+            self._finish_shard()
+
+    def _finish_shard(self):
+        number = len(self.index["shards"])
+        path = os.path.join(self.directory, shard_filename(number))
+        shard, self._shard = self._shard, None
+        shard.flush()
+        if self._count < self.shard_size:
+            # trim the last, partly filled shard, so its rows are all images
+            trimmed = np.lib.format.open_memmap(
+                path + ".tmp",
+                mode="w+",
+                dtype=np.uint8,
+                shape=(self._count,) + self.image_shape,
+            )
+            trimmed[:] = shard[: self._count]
+            trimmed.flush()
+            del trimmed, shard
+            os.replace(path + ".tmp", path)
+        self.index["shards"].append({"file": shard_filename(number), "count": self._count})
+        self._save_index()
+
+    def _save_index(self):
+        path = os.path.join(self.directory, INDEX_FILENAME)
+        with open(path + ".tmp", "w") as f:
+            json.dump(self.index, f)
+        os.replace(path + ".tmp", path)
+
+    def close(self):
+        if self._shard is not None and self._count:
+            self._finish_shard()
+        elif self._shard is not None:
+            self._shard = None
+            os.remove(
+                os.path.join(self.directory, shard_filename(len(self.index["shards"])))
+            )
+
+
+class ShardDataset:
+    """
+    Read-only access to a shard directory, through memory maps.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index = load_index(directory)
+        if self.index is None:
+            raise FileNotFoundError(f"No {INDEX_FILENAME} in {directory}")
+        self.shards = [
+            np.load(os.path.join(directory, shard["file"]), mmap_mode="r")
+            for shard in self.index["shards"]
+        ]
+        counts = [shard["count"] for shard in self.index["shards"]]
+        # global index of the first image in each shard
+        self._offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        self.filenames = self.index["filenames"][: self._offsets[-1]]
+        self.image_shape = tuple(self.index["image_shape"])
+
+    def __len__(self):
+        return int(self._offsets[-1])
+
+    def __getitem__(self, i):
+        shard_number = np.searchsorted(self._offsets, i, side="right") - 1
+        return self.shards[shard_number][i - self._offsets[shard_number]]
+
+    def take(self, indices):
+        """
+        Gather the images at the given global indices into one (n, h, w, 3) array.
+
+        Indices are grouped by shard, and sorted within each, so the reads from the
+        memory maps are as sequential as possible.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        batch = np.empty((len(indices),) + self.image_shape, dtype=np.uint8)
+        shard_numbers = np.searchsorted(self._offsets, indices, side="right") - 1
+        for shard_number in np.unique(shard_numbers):
+            positions = np.flatnonzero(shard_numbers == shard_number)
+            local = indices[positions] - self._offsets[shard_number]
+            order = np.argsort(local)
+            batch[positions[order]] = self.shards[shard_number][local[order]]
+        return batch
+
+    def batches(
+        self, batch_size, shuffle=True, seed=None, normalize=False, drop_remainder=False
+    ):
+        """
+        Yield batches covering the whole dataset once, in shuffled order by default.
+
+        With normalize, batches are float32 in [0, 1], as the autoencoder expects,
+        otherwise the raw uint8 images.
+        """
+        order = np.arange(len(self))
+        if shuffle:
+            np.random.default_rng(seed).shuffle(order)
+        for start in range(0, len(order), batch_size):
+            indices = order[start : start + batch_size]
+            if drop_remainder and len(indices) < batch_size:
+                return
+            batch = self.take(indices)
+            if normalize:
+                batch = batch.astype(np.float32)
+                batch /= 255.0
+            yield batch
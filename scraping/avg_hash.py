@@ -10,57 +10,33 @@ https://www.hackerfactor.com/blog/index.php?/archives/432-Looks-Like-It.html
 """
 
 import os
-import shutil
 import sys
-from PIL import Image
-import imagehash
+
+import dedupe
 
 
 def main():
     """
     For each jpg file in passed directory, calculate the average hash
     and move observed clusters to new subdirectories for manual review.
+
+    Hashes are kept in an index file in the directory, so re-runs only hash new or
+    changed images. Images whose hashes differ by at most max_distance bits are
+    clustered together, the default of 0 only groups identical hashes.
+    See dedupe.py to compute several hashes in one pass, or for a dry run.
     """
     print("Starting image hashing")
-    if len(sys.argv) != 2:
-        print("Usage: python3 avg_hash.py <directory>")
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python3 avg_hash.py <directory> [max_distance]")
         sys.exit(1)
 
     directory = sys.argv[1]
     if not os.path.isdir(directory):
         print(f"{directory} is not a directory")
         sys.exit(1)
+    max_distance = int(sys.argv[2]) if len(sys.argv) == 3 else 0
 
-    image_hash_images = {}
-
-    print(f"Processing images in {directory}")
-    for filename in os.listdir(directory):
-        if filename.endswith(".jpg"):
-            file_path = os.path.join(directory, filename)
-            img_hash = imagehash.average_hash(Image.open(file_path))
-            # print(f"Hash for {file_path} is {img_hash}")
-
-            # store the hash in a dictionary
-            # and group any images with the same hash together
-            if img_hash in image_hash_images:
-                image_hash_images[img_hash].append(file_path)
-            else:
-                image_hash_images[img_hash] = [file_path]
-
-    # once all images are processed, find any clusters
-    # in the dictionary with more than 1 image, and move them
-    # to a subdirectory named after the hash
-    print(f"Checking {len(image_hash_images)} hashes")
-    for img_hash, files in image_hash_images.items():
-        if len(files) > 1:
-            print(
-                f"Cluster of {len(files)} found for hash {img_hash}, moving to new directory"
-            )
-            hash_dir = os.path.join(directory, str(img_hash))
-            if not os.path.exists(hash_dir):
-                os.mkdir(hash_dir)
-            for file in files:
-                shutil.move(file, hash_dir)
+    dedupe.run(directory, ["average"], max_distance=max_distance)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,226 @@
+"""
+This module finds duplicate and similar images with any combination of image hashes,
+decoding each image only once.
+
+Hashing is spread over a process pool, and hashes are kept in the directory's hash
+index (see hash_index.py), so re-runs only decode new or changed images. Clusters of
+similar images are moved to subdirectories for manual review, or just reported with
+--dry-run.
+
+Usage:
+    python3 dedupe.py <directory> [--hashes average perceptual] [--max-distance 4]
+        [--cluster-by perceptual] [--workers 8] [--dry-run] [--report clusters.json]
+
+https://pypi.org/project/ImageHash/
+https://www.hackerfactor.com/blog/index.php?/archives/432-Looks-Like-It.html
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import imagehash
+from PIL import Image
+
+import hash_index
+
+
+# what a corrupt, truncated or oversized image can raise while decoding, PIL's
+# plugins raise SyntaxError or ValueError for some malformed files
+IMAGE_ERRORS = (OSError, ValueError, SyntaxError, Image.DecompressionBombError)
+
+HASH_FUNCTIONS = {
+    "average": imagehash.average_hash,
+    "perceptual": imagehash.phash,
+    "difference": imagehash.dhash,
+    "wavelet": imagehash.whash,
+}
+
+
+def hash_image(path, hash_names):
+    """
+    Decode the image once and return a dict of hash name to hex hash.
+    """
+    with Image.open(path) as img:
+        # every hash works on the greyscale image, so convert it once up front
+        grey = img.convert("L")
+    return {name: str(HASH_FUNCTIONS[name](grey)) for name in hash_names}
+
+
+def hash_directory(directory, hash_names, index, workers=None, max_in_flight=None):
+    """
+    Return a dict of hash name to a dict of path to hex hash, for every jpg in the
+    directory. Only images missing one of the hashes from the index are decoded.
+
+    At most max_in_flight images are queued in the pool at once, so memory stays
+    bounded however large the directory is.
+    """
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or workers * 4
+    images = hash_index.list_images(directory)
+    hashes = {name: {} for name in hash_names}
+    todo = []
+    for path, stat in images:
+        missing = []
+        for name in hash_names:
+            hex_hash = index.get(path, name, stat)
+            if hex_hash is None:
+                missing.append(name)
+            else:
+                hashes[name][path] = hex_hash
+        if missing:
+            todo.append((path, stat, missing))
+    print(f"{len(images)} images, {len(todo)} new or changed to hash")
+
+    start = time.perf_counter()
+    done = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        todo_iter = iter(todo)
+        while True:
+            for path, stat, missing in todo_iter:
+                pending[executor.submit(hash_image, path, missing)] = (path, stat)
+                if len(pending) >= max_in_flight:
+                    break
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            new_entries = []
+            for future in finished:
+                path, stat = pending.pop(future)
+                try:
+                    image_hashes = future.result()
+                except IMAGE_ERRORS as e:
+                    print(f"Skipping {path}: {type(e).__name__}: {e}", file=sys.stderr)
+                    continue
+                for name, hex_hash in image_hashes.items():
+                    hashes[name][path] = hex_hash
+                    new_entries.append((path, name, stat, hex_hash))
+            index.put_many(new_entries)
+            done += len(finished)
+            if done % 1000 < len(finished) or not pending:
+                elapsed = time.perf_counter() - start
+                print(f"Hashed {done}/{len(todo)} images, {done / elapsed:.1f} images/s")
+
+    index.prune(path for path, _ in images)
+    return hashes
+
+
+def move_clusters(directory, clusters, image_hashes):
+    """
+    Move each cluster to a subdirectory named after the hash of its first image.
+    """
+    for files in clusters:
+        img_hash = image_hashes[files[0]]
+        print(
+            f"Cluster of {len(files)} found for hash {img_hash}, moving to new directory"
+        )
+        hash_dir = os.path.join(directory, str(img_hash))
+        if not os.path.exists(hash_dir):
+            os.mkdir(hash_dir)
+        for file in files:
+            shutil.move(file, hash_dir)
+
+
+def report_clusters(clusters, hashes):
+    """Print the clusters, with every computed hash of each image."""
+    for files in clusters:
+        print(f"Cluster of {len(files)}:")
+        for file in files:
+            file_hashes = " ".join(
+                f"{name}={values[file]}"
+                for name, values in hashes.items()
+                if file in values
+            )
+            print(f"  {file} {file_hashes}")
+
+
+def run(
+    directory,
+    hash_names,
+    max_distance=0,
+    cluster_by=None,
+    dry_run=False,
+    report_path=None,
+    workers=None,
+):
+    """
+    Hash the directory and move (or, with dry_run, report) the clusters.
+    """
+    cluster_by = cluster_by or hash_names[0]
+    if cluster_by not in hash_names:
+        hash_names = list(hash_names) + [cluster_by]
+
+    print(f"Processing images in {directory}")
+    index_path = os.path.join(directory, hash_index.DEFAULT_INDEX_FILENAME)
+    with hash_index.HashIndex(index_path) as index:
+        hashes = hash_directory(directory, hash_names, index, workers=workers)
+
+    print(
+        f"Checking {len(hashes[cluster_by])} {cluster_by} hashes "
+        f"within distance {max_distance}"
+    )
+    clusters = hash_index.find_clusters(hashes[cluster_by], max_distance)
+    print(f"Found {len(clusters)} clusters")
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump({"cluster_by": cluster_by, "clusters": clusters}, f, indent=2)
+    if dry_run:
+        report_clusters(clusters, hashes)
+    else:
+        move_clusters(directory, clusters, hashes[cluster_by])
+    return clusters
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Find and group duplicate and similar images."
+    )
+    parser.add_argument("directory")
+    parser.add_argument(
+        "--hashes",
+        nargs="+",
+        choices=sorted(HASH_FUNCTIONS),
+        default=["average"],
+        help="hashes to compute for each image",
+    )
+    parser.add_argument(
+        "--cluster-by",
+        choices=sorted(HASH_FUNCTIONS),
+        help="hash used to cluster images, defaults to the first of --hashes",
+    )
+    parser.add_argument(
+        "--max-distance",
+        type=int,
+        default=0,
+        help="maximum number of differing bits within a cluster",
+    )
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--dry-run", action="store_true", help="report clusters instead of moving them"
+    )
+    parser.add_argument("--report", help="also write the clusters to this JSON file")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.directory):
+        print(f"{args.directory} is not a directory")
+        sys.exit(1)
+
+    print("Starting image hashing")
+    run(
+        args.directory,
+        args.hashes,
+        max_distance=args.max_distance,
+        cluster_by=args.cluster_by,
+        dry_run=args.dry_run,
+        report_path=args.report,
+        workers=args.workers,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+"""
+A persistent index of image hashes, with Hamming-distance search for near-duplicates.
+
+Hashes are stored in a SQLite file, keyed by path and hash type, along with the file
+size and modification time they were computed from. Re-running over a directory
+only hashes new or changed files.
+
+Near-duplicates are found with a BK-tree, a metric tree that answers "all hashes
+within distance r" queries without comparing every pair of images.
+"""
+
+import os
+import sqlite3
+
+
+DEFAULT_INDEX_FILENAME = ".hash_index.sqlite"
+
+
+def hamming_distance(hash_a, hash_b):
+    """Number of differing bits between two integer hashes."""
+    return bin(hash_a ^ hash_b).count("1")
+
+
+def hash_to_int(hex_hash):
+    return int(hex_hash, 16)
+
+
+class HashIndex:
+    """
+    Image hashes persisted in SQLite, invalidated when a file's size or mtime changes.
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._db = sqlite3.connect(db_path)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS hashes (
+                path TEXT NOT NULL,
+                hash_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (path, hash_name)
+            )
+            """
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._db.commit()
+        self._db.close()
+
+    def get(self, path, hash_name, stat):
+        """Return the stored hex hash, or None if missing or the file has changed."""
+        row = self._db.execute(
+            "SELECT size, mtime_ns, hash FROM hashes WHERE path = ? AND hash_name = ?",
+            (path, hash_name),
+        ).fetchone()
+        if row is None or row[0] != stat.st_size or row[1] != stat.st_mtime_ns:
+            return None
+        return row[2]
+
+    def put_many(self, entries):
+        """Store (path, hash_name, stat, hex_hash) tuples."""
+        self._db.executemany(
+            "INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+            [
+                (path, hash_name, stat.st_size, stat.st_mtime_ns, hex_hash)
+                for path, hash_name, stat, hex_hash in entries
+            ],
+        )
+        self._db.commit()
+
+    def prune(self, existing_paths):
+        """Forget files that are no longer on disk, e.g. after being moved."""
+        existing_paths = set(existing_paths)
+        stored = [row[0] for row in self._db.execute("SELECT DISTINCT path FROM hashes")]
+        removed = [(path,) for path in stored if path not in existing_paths]
+        self._db.executemany("DELETE FROM hashes WHERE path = ?", removed)
+        self._db.commit()
+        return len(removed)
+
+
+class BKTree:
+    """
+    A Burkhard-Keller tree over integer hashes, for Hamming-distance radius queries.
+
+    Each node keeps its children keyed by their distance to it. By the triangle
+    inequality, a query with radius r only has to visit children whose key is within
+    r of the query's distance to the node.
+    """
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, hash_value, item):
+        self._size += 1
+        node = (hash_value, item, {})
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming_distance(hash_value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def query(self, hash_value, radius):
+        """Return (distance, item) for every entry within radius of hash_value."""
+        if self._root is None:
+            return []
+        matches = []
+        stack = [self._root]
+        while stack:
+            node_hash, item, children = stack.pop()
+            distance = hamming_distance(hash_value, node_hash)
+            if distance <= radius:
+                matches.append((distance, item))
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return matches
+
+
+def list_images(directory, extensions=(".jpg",)):
+    """Return the image files directly inside the directory, with their stat results."""
+    images = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_file() and entry.name.lower().endswith(extensions):
+                images.append((entry.path, entry.stat()))
+    return images
+
+
+def find_clusters(hashes, max_distance=0):
+    """
+    Group paths whose hashes are within max_distance bits of each other.
+
+    Returns a list of clusters with more than one path. Clusters are the connected
+    components of the "within max_distance" relation, so two images in a cluster
+    may be further apart than max_distance via a chain of similar images.
+    """
+    # exact duplicates share one entry, so a large duplicate cluster is one tree node
+    paths_by_hash = {}
+    for path, hex_hash in hashes.items():
+        paths_by_hash.setdefault(hash_to_int(hex_hash), []).append(path)
+    if max_distance == 0:
+        return [sorted(paths) for paths in paths_by_hash.values() if len(paths) > 1]
+
+    unique_hashes = list(paths_by_hash)
+    tree = BKTree()
+    for i, hash_value in enumerate(unique_hashes):
+        tree.add(hash_value, i)
+
+    # union-find over unique hash indexes
+    parents = list(range(len(unique_hashes)))
+
+    def find(i):
+        while parents[i] != i:
+            parents[i] = parents[parents[i]]
+            i = parents[i]
+        return i
+
+    for i, hash_value in enumerate(unique_hashes):
+        for _, j in tree.query(hash_value, max_distance):
+            root_i, root_j = find(i), find(j)
+            if root_i != root_j:
+                parents[root_j] = root_i
+
+    clusters = {}
+    for i, hash_value in enumerate(unique_hashes):
+        clusters.setdefault(find(i), []).extend(paths_by_hash[hash_value])
+    return [sorted(files) for files in clusters.values() if len(files) > 1]
@@ -0,0 +1,203 @@
+"""
+Record a training progress video while the autoencoder trains.
+
+LiveProgressVideo is a Keras callback that decodes a fixed set of latent probes every
+N batches or epochs, tiles the decoded chairs into one grid frame, and appends it to a
+video (and optionally saves it as a PNG). This replaces screenshotting the notebook
+and running video.py afterwards.
+
+All probes are decoded in one call, and the frames are encoded on a background
+thread, so a training step only pays for one small forward pass.
+
+Example, in the training notebook:
+    from live_video import LiveProgressVideo, random_probes
+    progress = LiveProgressVideo(
+        decoder, random_probes(16), "raw_data/training-video/output/live.mp4",
+        every_n_batches=200,
+    )
+    vae.fit(x_train, epochs=50, callbacks=[progress])
+"""
+
+import math
+import os
+import queue
+import threading
+
+import cv2  # from opencv-python
+import numpy as np
+from tensorflow import keras
+
+
+def random_probes(count=16, encoding_dim=100, seed=0):
+    """Return (count, encoding_dim) latent vectors drawn from the VAE's prior."""
+    return np.random.default_rng(seed).standard_normal((count, encoding_dim)).astype(
+        np.float32
+    )
+
+
+def tile_frames(images, columns=None, scale=1):
+    """
+    Tile a (n, height, width, 3) batch of RGB images in [0, 1] into one BGR uint8
+    grid, as cv2 expects.
+    """
+    count, height, width, channels = images.shape
+    columns = columns or math.ceil(math.sqrt(count))
+    rows = math.ceil(count / columns)
+    grid = np.ones((rows * height, columns * width, channels), dtype=np.float32)
+    for i, image in enumerate(images):
+        row, column = divmod(i, columns)
+        grid[row * height : (row + 1) * height, column * width : (column + 1) * width] = image
+    grid = np.clip(grid * 255.0 + 0.5, 0, 255).astype(np.uint8)
+    if scale != 1:
+        grid = cv2.resize(
+            grid, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST
+        )
+    return cv2.cvtColor(grid, cv2.COLOR_RGB2BGR)
+
+
+class FrameWriter(threading.Thread):
+    """
+    Append frames to a video, and optionally save each as a PNG, on a background
+    thread. The video is opened with the size of the first frame.
+
+    When the queue is full, new frames are dropped rather than blocking training,
+    and counted in dropped_frames. If writing fails, the thread stops, the exception
+    is kept in error, and later frames are dropped.
+    """
+
+    def __init__(self, output_path, fps=4, image_dir=None, max_queue=32):
+        super().__init__(name="progress-frame-writer", daemon=True)
+        self.output_path = output_path
+        self.fps = fps
+        self.image_dir = image_dir
+        self.dropped_frames = 0
+        self.written_frames = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._video = None
+
+    def submit(self, frame, label):
+        if self.error is not None:
+            self.dropped_frames += 1
+            return
+        try:
+            self._queue.put_nowait((frame, label))
+        except queue.Full:
+            self.dropped_frames += 1
+
+    def close(self, timeout=60):
+        """Write the queued frames and finish the video."""
+        # if the thread has died, nothing drains the queue, so never block on it
+        while self.is_alive():
+            try:
+                self._queue.put(None, timeout=1)
+                break
+            except queue.Full:
+                continue
+        self.join(timeout)
+
+    def run(self):
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                frame, label = item
+                if self._video is None:
+                    height, width = frame.shape[:2]
+                    fourcc = cv2.VideoWriter_fourcc(*"avc1")
+                    self._video = cv2.VideoWriter(
+                        self.output_path, fourcc, self.fps, (width, height)
+                    )
+                self._video.write(frame)
+                if self.image_dir:
+                    path = os.path.join(self.image_dir, f"{label}.png")
+                    if not cv2.imwrite(path, frame):
+                        raise IOError(f"Could not write {path}")
+                self.written_frames += 1
+        except Exception as e:
+            self.error = e
+        finally:
+            if self._video is not None:
+                self._video.release()
+
+
+class LiveProgressVideo(keras.callbacks.Callback):
+    """
+    Decode fixed latent probes during training, and record the results as a video.
+
+    Args:
+        decoder (keras.Model): The decoder being trained, e.g. from
+            autoencoder.build_decoder_vae.
+        probes (numpy.ndarray): (n, encoding_dim) latent vectors, decoded for every
+            frame. Keep them fixed, so the frames show the same chairs improving.
+        output_path (str): The video file to write.
+        every_n_batches (int, optional): Record a frame every this many batches.
+        every_n_epochs (int): Record a frame every this many epochs, used when
+            every_n_batches is not set.
+        fps (int): Frames per second of the video.
+        image_dir (str, optional): Also save each frame as a PNG in this directory.
+        scale (int): Upscale factor for the frames, the decoded chairs are small.
+    """
+
+    def __init__(
+        self,
+        decoder,
+        probes,
+        output_path,
+        every_n_batches=None,
+        every_n_epochs=1,
+        fps=4,
+        image_dir=None,
+        scale=2,
+    ):
+        super().__init__()
+        self.decoder = decoder
+        self.probes = np.asarray(probes, dtype=np.float32)
+        self.output_path = output_path
+        self.every_n_batches = every_n_batches
+        self.every_n_epochs = every_n_epochs
+        self.fps = fps
+        self.image_dir = image_dir
+        self.scale = scale
+        self.writer = None
+        self._epoch = 0
+        self._seen_batches = 0
+
+    def on_train_begin(self, logs=None):
+        if self.image_dir:
+            os.makedirs(self.image_dir, exist_ok=True)
+        self.writer = FrameWriter(self.output_path, self.fps, self.image_dir)
+        self.writer.start()
+        self._record("start")
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch = epoch
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._seen_batches += 1
+        if self.every_n_batches and self._seen_batches % self.every_n_batches == 0:
+            self._record(f"epoch-{self._epoch:04d}-batch-{batch:06d}")
+
+    def on_epoch_end(self, epoch, logs=None):
+        if not self.every_n_batches and (epoch + 1) % self.every_n_epochs == 0:
+            self._record(f"epoch-{epoch:04d}")
+
+    def on_train_end(self, logs=None):
+        self.writer.close()
+        if self.writer.error is not None:
+            print(
+                f"LiveProgressVideo stopped recording, {self.writer.dropped_frames} "
+                f"frames dropped: {self.writer.error!r}"
+            )
+        elif self.writer.dropped_frames:
+            print(
+                f"LiveProgressVideo dropped {self.writer.dropped_frames} frames, "
+                "the writer could not keep up"
+            )
+
+    def _record(self, label):
+        # one forward pass over all the probes, outside of model.fit's graph
+        images = self.decoder(self.probes, training=False)
+        frame = tile_frames(np.asarray(images), scale=self.scale)
+        self.writer.submit(frame, label)
@@ -1,4 +1,9 @@
+import argparse
+import itertools
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from tqdm import tqdm
 import cv2  # from opencv-python
 
@@ -22,47 +27,141 @@ def sort_images_by_filename(directory):
     return images
 
 
+def crop_frame(image, image_path, frame_width, frame_height):
+    """
+    Crop the image to the top-left frame_width x frame_height, or return None if it is
+    missing or too small.
+    """
+    if image is None:
+        print(f"Unable to read image at {image_path}")
+        return None
+
+    if image.shape[0] < frame_height or image.shape[1] < frame_width:
+        print(
+            f"Warning: Image at {image_path} is too small. Expected size: ({frame_width}, {frame_height}). Actual size: {image.shape[:2]}"
+        )
+        return None
+
+    # cropped_image = cv2.resize(image, (frame_width, frame_height))
+    cropped_image = image[:frame_height, :frame_width]
+
+    if (
+        cropped_image.shape[0] != frame_height
+        or cropped_image.shape[1] != frame_width
+    ):
+        print(
+            f"Warning: cropped image {image_path} is too small. Expected size: ({frame_width}, {frame_height}). Actual size: {image.shape[:2]}"
+        )
+        return None
+    return cropped_image
+
+
 def crop_images(images, output_dir, frame_width, frame_height):
     for image_path in tqdm(images, desc="Processing images"):
         image = cv2.imread(image_path)
-        if image is None:
-            print(f"Unable to read image at {image_path}")
-            continue
-
-        if image.shape[0] < frame_height or image.shape[1] < frame_width:
-            print(
-                f"Warning: Image at {image_path} is too small. Expected size: ({frame_width}, {frame_height}). Actual size: {image.shape[:2]}"
-            )
-            continue
-
-        # cropped_image = cv2.resize(image, (frame_width, frame_height))
-        cropped_image = image[:frame_height, :frame_width]
-
-        if (
-            cropped_image.shape[0] != frame_height
-            or cropped_image.shape[1] != frame_width
-        ):
-            print(
-                f"Warning: cropped image {image_path} is too small. Expected size: ({frame_width}, {frame_height}). Actual size: {image.shape[:2]}"
-            )
+        cropped_image = crop_frame(image, image_path, frame_width, frame_height)
+        if cropped_image is None:
             continue
 
         # write images to intermediate path
         cv2.imwrite(output_dir + "/" + image_path.split("/")[-1], cropped_image)
 
 
-def create_video(images, output_path, fps):
-    frame_width = cv2.imread(images[0]).shape[1]
-    frame_height = cv2.imread(images[0]).shape[0]
+def iter_frames(images, frame_size=None, prefetch=16, workers=4):
+    """
+    Yield the decoded images in order, reading ahead on a thread pool so that disk
+    reads and decoding overlap with the video encoding.
+
+    Args:
+        images (List[str]): The image paths, in frame order.
+        frame_size (Tuple[int, int], optional): (width, height) to crop each image to.
+            Images that can't be read or cropped are skipped.
+        prefetch (int): The maximum number of images decoded ahead of the consumer.
+        workers (int): The number of decoding threads.
+
+    Yields:
+        numpy.ndarray: The BGR frames.
+    """
+
+    def load(image_path):
+        # cv2 releases the GIL while reading and decoding
+        image = cv2.imread(image_path)
+        if frame_size is None:
+            if image is None:
+                print(f"Unable to read image at {image_path}")
+            return image
+        return crop_frame(image, image_path, *frame_size)
+
+    image_paths = iter(images)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque(
+            executor.submit(load, image_path)
+            for image_path in itertools.islice(image_paths, prefetch)
+        )
+        while pending:
+            frame = pending.popleft().result()
+            next_path = next(image_paths, None)
+            if next_path is not None:
+                pending.append(executor.submit(load, next_path))
+            if frame is not None:
+                yield frame
+
+
+def write_video(frames, output_path, fps, frame_width, frame_height, total=None):
     fourcc = cv2.VideoWriter_fourcc(*"avc1")
     video = cv2.VideoWriter(output_path, fourcc, fps, (frame_width, frame_height))
-    for image_path in tqdm(images, desc="Creating video"):
-        image = cv2.imread(image_path)
-        video.write(image)
+    for frame in tqdm(frames, desc="Creating video", total=total):
+        video.write(frame)
     video.release()
 
 
+def create_video(images, output_path, fps):
+    frames = iter_frames(images)
+    first_frame = next(frames, None)
+    if first_frame is None:
+        if not images:
+            raise ValueError("No images to make the video from")
+        source = os.path.dirname(images[0])
+        raise ValueError(f"None of the {len(images)} images in {source} could be read")
+    frame_height, frame_width = first_frame.shape[:2]
+    write_video(
+        itertools.chain([first_frame], frames),
+        output_path,
+        fps,
+        frame_width,
+        frame_height,
+        total=len(images),
+    )
+
+
+def stream_video(images, output_path, fps, frame_width, frame_height, prefetch=16):
+    """
+    Crop the images in memory and encode them straight into the video, without
+    writing intermediate files.
+    """
+    write_video(
+        iter_frames(images, (frame_width, frame_height), prefetch=prefetch),
+        output_path,
+        fps,
+        frame_width,
+        frame_height,
+        total=len(images),
+    )
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Turn the training progress screenshots into a video."
+    )
+    parser.add_argument(
+        "--from-intermediate",
+        action="store_true",
+        help="encode the already cropped images in the intermediate directory, "
+        "instead of streaming the cropped input images",
+    )
+    parser.add_argument("--fps", type=int, default=4)
+    parser.add_argument("--prefetch", type=int, default=16)
+    args = parser.parse_args()
 
     current_dir = os.path.dirname(os.path.abspath(__file__))
     # original input images
@@ -79,19 +178,29 @@ if __name__ == "__main__":
     # halt if directories do not exist
 
     for target_dir in [
-        source_dir,
-        intermediate_dir,
+        intermediate_dir if args.from_intermediate else source_dir,
         os.path.dirname(output_video_path),
     ]:
         if not os.path.exists(target_dir):
-            print(f"Error: Source directory not found at {source_dir}")
+            print(f"Error: Source directory not found at {target_dir}")
             exit(1)
 
-    # crop the original input images, if not already processed
-    # re-enable this manually if needed
-    # crop_images(sort_images_by_filename(source_dir), intermediate_dir, 1280, 1024)
-
-    # turn cropped images into video
-    sorted_images = sort_images_by_filename(intermediate_dir)
-    print(sorted_images)
-    create_video(sorted_images, output_video_path, fps=4)
+    if args.from_intermediate:
+        # crop the original input images, if not already processed
+        # re-enable this manually if needed
+        # crop_images(sort_images_by_filename(source_dir), intermediate_dir, 1280, 1024)
+
+        # turn cropped images into video
+        sorted_images = sort_images_by_filename(intermediate_dir)
+        print(sorted_images)
+        create_video(sorted_images, output_video_path, fps=args.fps)
+    else:
+        # crop the original input images in memory, straight into the video
+        stream_video(
+            sort_images_by_filename(source_dir),
+            output_video_path,
+            args.fps,
+            1280,
+            1024,
+            prefetch=args.prefetch,
+        )